@@ -1,6 +1,7 @@
 import os
+import time
 import logging
-from typing import List
+from typing import AsyncIterator, List
 
 from langchain.chat_models import init_chat_model
 from langchain.prompts import (
@@ -8,20 +9,33 @@ from langchain.prompts import (
     MessagesPlaceholder,
 )
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
 
-from models import Message
+from models import Message, LLMUsage
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "You are a helpful AI assistant. Answer questions clearly and concisely."
+
+# Providers whose chat models accept `cache_control` markers on content blocks
+PROMPT_CACHING_PROVIDERS = ("anthropic",)
+CACHE_CONTROL = {"type": "ephemeral"}
+
 class Chatbot:
     """
     Chatbot service for AI-powered conversations using LangChain.
     """
     
-    def __init__(self):
-        """Initialize the chatbot with LLM configuration."""
+    def __init__(self, llm=None, prompt_caching: bool = None):
+        """
+        Initialize the chatbot with LLM configuration.
+        
+        Args:
+            llm: Chat model to use instead of the one configured by environment
+            prompt_caching: Mark the stable prompt prefix as cacheable. Defaults to
+                LLM_PROMPT_CACHING when the provider supports prompt caching
+        """
         self.logger = logger
         self.logger.info("Chatbot initialized")
         
@@ -33,22 +47,64 @@ class Chatbot:
             "max_tokens": 1000,
         }
         
-        try:
-            self.llm = init_chat_model(**llm_config)
-            self.logger.info(f"LLM initialized with model: {llm_config['model']}")
-        except Exception as e:
-            self.logger.error(f"Failed to initialize LLM: {e}")
-            raise
+        if llm is not None:
+            self.llm = llm
+        else:
+            try:
+                self.llm = init_chat_model(**llm_config)
+                self.logger.info(f"LLM initialized with model: {llm_config['model']}")
+            except Exception as e:
+                self.logger.error(f"Failed to initialize LLM: {e}")
+                raise
+        
+        if prompt_caching is None:
+            prompt_caching = os.getenv("LLM_PROMPT_CACHING", "false").lower() == "true"
+            if prompt_caching and llm_config["model_provider"] not in PROMPT_CACHING_PROVIDERS:
+                self.logger.warning(f"Prompt caching not supported for provider {llm_config['model_provider']}, disabled")
+                prompt_caching = False
+        self.prompt_caching = prompt_caching
+        self.logger.info(f"Prompt caching {'enabled' if prompt_caching else 'disabled'}")
+        
+        # Token usage reported by the provider, including cached prompt tokens
+        self.usage = LLMUsage()
         
         # Conversation template
+        if self.prompt_caching:
+            system_message = SystemMessage(content=[
+                {"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}
+            ])
+        else:
+            system_message = ("system", SYSTEM_PROMPT)
         self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a helpful AI assistant. Answer questions clearly and concisely."),
+            system_message,
             MessagesPlaceholder(variable_name="chat_history"),
             ("user", "{input}"),
         ])
         
-        # Conversation chain (without memory - we'll build it dynamically)
-        self.conversation_chain = self.prompt | self.llm | StrOutputParser()
+        # Conversation chain (without memory - we'll build it dynamically).
+        # The LLM chain keeps the AI message so its usage metadata can be read.
+        self.output_parser = StrOutputParser()
+        self.llm_chain = self.prompt | self.llm
+        self.conversation_chain = self.llm_chain | self.output_parser
+
+    def convert_message(self, message: Message):
+        """
+        Convert a single Message object to LangChain message format.
+        
+        Args:
+            message: Message object
+            
+        Returns:
+            LangChain message object
+        """
+        if message.role == "user":
+            return HumanMessage(content=message.content)
+        if message.role == "assistant":
+            return AIMessage(content=message.content)
+        
+        # Handle any other roles as human messages
+        self.logger.warning(f"Unknown message role: {message.role}, treating as human")
+        return HumanMessage(content=message.content)
 
     def _convert_messages_to_langchain(self, messages: List[Message]) -> List:
         """
@@ -60,19 +116,60 @@ class Chatbot:
         Returns:
             List of LangChain message objects
         """
-        langchain_messages = []
-        
-        for msg in messages:
-            if msg.role == "user":
-                langchain_messages.append(HumanMessage(content=msg.content))
-            elif msg.role == "assistant":
-                langchain_messages.append(AIMessage(content=msg.content))
-            else:
-                # Handle any other roles as human messages
-                self.logger.warning(f"Unknown message role: {msg.role}, treating as human")
-                langchain_messages.append(HumanMessage(content=msg.content))
-        
-        return langchain_messages
+        return [self.convert_message(msg) for msg in messages]
+
+    def _mark_cacheable(self, message: BaseMessage) -> BaseMessage:
+        """Return a copy of the message whose content carries a cache marker."""
+        if not isinstance(message.content, str):
+            return message
+        return message.model_copy(update={"content": [
+            {"type": "text", "text": message.content, "cache_control": CACHE_CONTROL}
+        ]})
+
+    def _prepare_history(self, chat_history: List) -> List:
+        """
+        Mark cache breakpoints in the chat history when prompt caching is enabled.
+        
+        The stable prefix is the system message plus the whole history; only
+        the new question changes. Breakpoints go on the last history message
+        (cached for the next turn) and on the last message of the previous
+        turn's history (cached by the previous call, so it is read back even
+        when the new prefix is not cached yet). With the system message this
+        uses 3 of the 4 breakpoints providers allow.
+        
+        Args:
+            chat_history: LangChain messages preceding the user input
+            
+        Returns:
+            History to send, sharing all unmarked messages with the input
+        """
+        if not self.prompt_caching or not chat_history:
+            return chat_history
+        
+        history = list(chat_history)
+        # A turn is a question and an answer, so the previous turn's history ended 2 messages earlier
+        for index in (len(history) - 1, len(history) - 3):
+            if index >= 0:
+                history[index] = self._mark_cacheable(history[index])
+        return history
+
+    def _record_usage(self, message: BaseMessage) -> None:
+        """Add the token usage reported on an AI message (or chunk) to the totals."""
+        usage_metadata = getattr(message, "usage_metadata", None)
+        if not usage_metadata:
+            return
+        
+        self.usage.input_tokens += usage_metadata.get("input_tokens", 0)
+        self.usage.output_tokens += usage_metadata.get("output_tokens", 0)
+        input_token_details = usage_metadata.get("input_token_details") or {}
+        self.usage.cache_read_tokens += input_token_details.get("cache_read") or 0
+        self.usage.cache_creation_tokens += input_token_details.get("cache_creation") or 0
+        if input_token_details.get("cache_read"):
+            self.logger.debug(f"Prompt cache hit: {input_token_details['cache_read']} tokens")
+
+    def get_usage(self) -> LLMUsage:
+        """Get the accumulated token usage."""
+        return self.usage.model_copy()
 
     async def ainvoke(self, user_message: str, previous_messages: List[Message]) -> str:
         """
@@ -89,13 +186,18 @@ class Chatbot:
             self.logger.debug(f"Processing message with {len(previous_messages)} previous messages")
             
             # Build chat history from previous messages
-            chat_history = self._convert_messages_to_langchain(previous_messages)
+            chat_history = self._prepare_history(self._convert_messages_to_langchain(previous_messages))
             
-            # Invoke the conversation chain with the built history
-            response = await self.conversation_chain.ainvoke({
+            # Invoke the LLM chain with the built history
+            started_at = time.monotonic()
+            ai_message = await self.llm_chain.ainvoke({
                 "input": user_message,
                 "chat_history": chat_history
             })
+            self.usage.latency_seconds += time.monotonic() - started_at
+            self.usage.calls += 1
+            self._record_usage(ai_message)
+            response = self.output_parser.invoke(ai_message)
             
             self.logger.debug(f"Generated response: {response[:100]}...")
             return response
@@ -104,6 +206,43 @@ class Chatbot:
             self.logger.error(f"Error during AI invocation: {e}")
             raise
 
+    async def astream(self, user_message: str, chat_history: List) -> AsyncIterator[str]:
+        """
+        Stream the LLM answer token by token.
+        
+        Unlike ainvoke, the history is passed already converted to LangChain
+        messages, so callers holding a long-lived conversation can convert
+        each message once.
+        
+        Args:
+            user_message: The current user input
+            chat_history: LangChain messages preceding the user input
+            
+        Yields:
+            Chunks of the AI response text
+        """
+        try:
+            self.logger.debug(f"Streaming message with {len(chat_history)} previous messages")
+            
+            self.usage.calls += 1
+            started_at = time.monotonic()
+            try:
+                async for chunk in self.llm_chain.astream({
+                    "input": user_message,
+                    "chat_history": self._prepare_history(chat_history)
+                }):
+                    # Usage metadata arrives on the first and last chunks
+                    self._record_usage(chunk)
+                    text = self.output_parser.invoke(chunk)
+                    if text:
+                        yield text
+            finally:
+                self.usage.latency_seconds += time.monotonic() - started_at
+                
+        except Exception as e:
+            self.logger.error(f"Error during AI streaming: {e}")
+            raise
+
     def invoke(self, user_message: str, previous_messages: List[Message]) -> str:
         """
         Synchronous version of ainvoke for compatibility.
@@ -119,13 +258,18 @@ class Chatbot:
             self.logger.debug(f"Processing sync message with {len(previous_messages)} previous messages")
             
             # Build chat history from previous messages
-            chat_history = self._convert_messages_to_langchain(previous_messages)
+            chat_history = self._prepare_history(self._convert_messages_to_langchain(previous_messages))
             
-            # Invoke the conversation chain with the built history
-            response = self.conversation_chain.invoke({
+            # Invoke the LLM chain with the built history
+            started_at = time.monotonic()
+            ai_message = self.llm_chain.invoke({
                 "input": user_message,
                 "chat_history": chat_history
             })
+            self.usage.latency_seconds += time.monotonic() - started_at
+            self.usage.calls += 1
+            self._record_usage(ai_message)
+            response = self.output_parser.invoke(ai_message)
             
             self.logger.debug(f"Generated sync response: {response[:100]}...")
             return response
@@ -1,20 +1,39 @@
 import logging
 from typing import List
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.responses import JSONResponse
 
 from models import (
-    Chat, SearchRequest, ChatTitleUpdateRequest, SearchResponse
+    Chat, SearchRequest, ChatTitleUpdateRequest, SearchResponse,
+    ForkChatRequest, RegenerateRequest, StatsResponse
 )
 from services import ChatService
+from scheduler import FairScheduler, QueueFullError
+from repositories import WriteBufferFullError
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
-def init_http_handlers(app: FastAPI, chat_service: ChatService):
+def init_http_handlers(app: FastAPI, chat_service: ChatService, scheduler: FairScheduler):
     """
     Initialize the HTTP handlers.
     """
+    async def run_scheduled(user_id: str, priority: str, http_response: Response, call):
+        """
+        Run LLM-bound work through the scheduler.
+        
+        Queue-wait and service times are returned in the X-Queue-Wait-Ms and
+        X-Service-Time-Ms headers. Users with too many pending requests get 429.
+        """
+        try:
+            async with scheduler.slot(user_id, priority) as ticket:
+                result = await call()
+        except QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        http_response.headers["X-Queue-Wait-Ms"] = f"{ticket.queue_wait * 1000:.1f}"
+        http_response.headers["X-Service-Time-Ms"] = f"{ticket.service_time * 1000:.1f}"
+        return result
+
     @app.get("/")
     async def get_root():
         """
@@ -24,12 +43,17 @@ def init_http_handlers(app: FastAPI, chat_service: ChatService):
         return {"message": "Hello, World!"}
 
     @app.post("/search", response_model=SearchResponse)
-    async def post_search(request: SearchRequest):
+    async def post_search(request: SearchRequest, http_response: Response):
         """
         Search endpoint that processes a user question and returns AI response.
         """
         logger.info(f"Search request received - User: {request.user_id}, Chat: {request.chat_id}, Question: {request.question[:50]}...")
-        return await chat_service.search(request)
+        return await run_scheduled(
+            request.user_id,
+            request.priority,
+            http_response,
+            lambda: chat_service.search(request)
+        )
 
 
     @app.get("/searches/{user_id}/chats/{chat_id}", response_model=Chat)
@@ -63,7 +87,7 @@ def init_http_handlers(app: FastAPI, chat_service: ChatService):
         Delete a single chat for a user.
         """
         logger.info(f"Delete chat request - User: {user_id}, Chat: {chat_id}")
-        deleted = chat_service.delete_chat(user_id, chat_id)
+        deleted = await chat_service.delete_chat(user_id, chat_id)
         if not deleted:
             logger.warning(f"Chat {chat_id} not found for deletion, user {user_id}")
             raise HTTPException(
@@ -78,7 +102,7 @@ def init_http_handlers(app: FastAPI, chat_service: ChatService):
         Update the title of a chat.
         """
         logger.info(f"Update chat title request - User: {user_id}, Chat: {chat_id}, New Title: {title_update.chat_title}")
-        updated_chat = chat_service.update_chat_title(user_id, chat_id, title_update.chat_title)
+        updated_chat = await chat_service.update_chat_title(user_id, chat_id, title_update.chat_title)
         if updated_chat is None:
             logger.warning(f"Chat {chat_id} not found for title update, user {user_id}")
             raise HTTPException(
@@ -87,6 +111,59 @@ def init_http_handlers(app: FastAPI, chat_service: ChatService):
             )
         return updated_chat
 
+    @app.post("/searches/{user_id}/chats/{chat_id}/fork", response_model=Chat)
+    async def post_fork_chat(user_id: str, chat_id: str, fork_request: ForkChatRequest):
+        """
+        Fork a chat into a new chat sharing its message history.
+        """
+        logger.info(f"Fork chat request - User: {user_id}, Chat: {chat_id}, New Chat: {fork_request.new_chat_id}")
+        try:
+            forked_chat = await chat_service.fork_chat(user_id, chat_id, fork_request)
+        except ValueError as e:
+            logger.warning(f"Cannot fork chat {chat_id} for user {user_id}: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+        if forked_chat is None:
+            logger.warning(f"Chat {chat_id} not found for fork, user {user_id}")
+            raise HTTPException(
+                status_code=404, 
+                detail=f"Chat {chat_id} not found for user {user_id}"
+            )
+        return forked_chat
+
+    @app.post("/searches/{user_id}/chats/{chat_id}/regenerate", response_model=SearchResponse)
+    async def post_regenerate(user_id: str, chat_id: str, regenerate_request: RegenerateRequest, http_response: Response):
+        """
+        Regenerate the answer to a previous user message.
+        """
+        logger.info(f"Regenerate request - User: {user_id}, Chat: {chat_id}, Message: {regenerate_request.message_index}")
+        try:
+            response = await run_scheduled(
+                user_id,
+                regenerate_request.priority,
+                http_response,
+                lambda: chat_service.regenerate(user_id, chat_id, regenerate_request)
+            )
+        except ValueError as e:
+            logger.warning(f"Cannot regenerate chat {chat_id} for user {user_id}: {e}")
+            raise HTTPException(status_code=400, detail=str(e))
+        if response is None:
+            logger.warning(f"Chat {chat_id} not found for regenerate, user {user_id}")
+            raise HTTPException(
+                status_code=404, 
+                detail=f"Chat {chat_id} not found for user {user_id}"
+            )
+        return response
+
+    @app.get("/stats", response_model=StatsResponse)
+    async def get_stats():
+        """
+        Usage statistics, cheap enough to poll frequently.
+        """
+        logger.debug("Stats endpoint accessed")
+        stats = chat_service.get_stats()
+        stats.scheduler = scheduler.get_stats()
+        return stats
+
     @app.get("/health")
     async def health_check():
         """
@@ -99,6 +176,14 @@ def init_http_handlers(app: FastAPI, chat_service: ChatService):
             "version": "1.0.0"
         }
 
+    @app.exception_handler(WriteBufferFullError)
+    async def write_buffer_full_handler(request, exc):
+        """
+        Reject writes while the persistence store is not keeping up.
+        """
+        logger.warning(f"Write rejected: {exc}")
+        return JSONResponse(status_code=503, content={"detail": str(exc)})
+
     @app.exception_handler(Exception)
     async def global_exception_handler(request, exc):
         """
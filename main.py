@@ -3,13 +3,16 @@ Main FastAPI application for the chatbot search application.
 """
 import os
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from dotenv import load_dotenv
 
 from httphandlers import init_http_handlers
-from repositories import InMemoryChatRepository
+from wshandlers import init_ws_handlers
+from repositories import InMemoryChatRepository, JsonlChatStore, WriteBehindChatRepository
 from chatbot import Chatbot
 from services import ChatService
+from scheduler import FairScheduler
 
 # Load environment variables
 load_dotenv()
@@ -38,15 +41,49 @@ def setup_logging():
 logger = setup_logging()
 
 # Initialize repositories
-chat_repository = InMemoryChatRepository()
+write_behind_log_path = os.getenv("WRITE_BEHIND_LOG_PATH")
+if write_behind_log_path:
+    chat_repository = WriteBehindChatRepository(
+        JsonlChatStore(write_behind_log_path),
+        flush_interval=float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "5")) / 1000,
+        batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "256")),
+        durability=os.getenv("WRITE_BEHIND_DURABILITY", "before"),
+        max_buffer_size=int(os.getenv("WRITE_BEHIND_MAX_BUFFER", "100000")),
+        max_retry_interval=float(os.getenv("WRITE_BEHIND_MAX_RETRY_MS", "5000")) / 1000,
+        compact_threshold=int(os.getenv("WRITE_BEHIND_COMPACT_RECORDS", "100000"))
+    )
+else:
+    chat_repository = InMemoryChatRepository()
 chatbot = Chatbot()
 chat_service = ChatService(chat_repository, chatbot)
 
+# Scheduler for LLM-bound requests; SCHEDULER_USER_WEIGHTS looks like "user_a=2,user_b=0.5"
+user_weights = {}
+for item in os.getenv("SCHEDULER_USER_WEIGHTS", "").split(","):
+    if "=" in item:
+        weight_user_id, weight = item.split("=", 1)
+        user_weights[weight_user_id.strip()] = float(weight)
+scheduler = FairScheduler(
+    max_concurrency=int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "16")),
+    max_pending_per_user=int(os.getenv("SCHEDULER_MAX_PENDING_PER_USER", "8")),
+    user_weights=user_weights
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start repository background work and flush pending writes on shutdown."""
+    chat_repository.start()
+    yield
+    await chat_repository.close()
+
 # Create FastAPI application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Initialize HTTP handlers
-init_http_handlers(app, chat_service)
+init_http_handlers(app, chat_service, scheduler)
+
+# Initialize WebSocket handlers
+init_ws_handlers(app, chat_service, scheduler)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -18,6 +18,7 @@ class Chat(BaseModel):
     messages: List[Message] = Field(default_factory=list, description="List of messages in the chat")
     created_at: datetime = Field(default_factory=datetime.now, description="Chat creation timestamp")
     updated_at: datetime = Field(default_factory=datetime.now, description="Last update timestamp")
+    parent_chat_id: Optional[str] = Field(None, description="Chat this chat was forked from, if any")
     
 
 class SearchRequest(BaseModel):
@@ -25,6 +26,7 @@ class SearchRequest(BaseModel):
     user_id: str = Field(..., description="User identifier")
     chat_id: str = Field(..., description="Chat identifier")
     question: str = Field(..., description="User's question")
+    priority: Literal["interactive", "batch"] = Field("interactive", description="Scheduling priority class")
 
 class SearchResponse(BaseModel):
     """Response model for the search endpoint."""
@@ -33,4 +35,56 @@ class SearchResponse(BaseModel):
 class ChatTitleUpdateRequest(BaseModel):
     """Request model for updating chat title."""
     chat_title: str = Field(..., description="New title for the chat")
- 
\ No newline at end of file
+ 
+class ForkChatRequest(BaseModel):
+    """Request model for forking a chat."""
+    new_chat_id: str = Field(..., description="Identifier for the forked chat")
+    message_count: Optional[int] = Field(None, ge=0, description="Number of leading messages to keep (defaults to all)")
+    chat_title: Optional[str] = Field(None, description="Title for the forked chat")
+
+class RegenerateRequest(BaseModel):
+    """Request model for regenerating an answer from a given user message."""
+    message_index: int = Field(..., ge=0, description="Index of the user message to answer again")
+    new_chat_id: Optional[str] = Field(None, description="If provided, regenerate into a new fork instead of in place")
+    priority: Literal["interactive", "batch"] = Field("interactive", description="Scheduling priority class")
+
+class TopEntry(BaseModel):
+    """A key with its message count."""
+    key: str = Field(..., description="User id or user_id/chat_id")
+    count: int = Field(..., description="Number of messages; see the list holding the entry")
+
+class LLMUsage(BaseModel):
+    """Token usage reported by the LLM provider."""
+    calls: int = Field(0, description="Number of LLM calls")
+    input_tokens: int = Field(0, description="Prompt tokens, including cached ones")
+    output_tokens: int = Field(0, description="Completion tokens")
+    cache_read_tokens: int = Field(0, description="Prompt tokens read from the provider's prompt cache")
+    cache_creation_tokens: int = Field(0, description="Prompt tokens written to the provider's prompt cache")
+    latency_seconds: float = Field(0.0, description="Total time spent waiting for the LLM")
+
+class PriorityStats(BaseModel):
+    """Scheduler statistics for one priority class."""
+    queued: int = Field(..., description="Requests waiting for a slot")
+    queue_wait_p50_ms: float = Field(..., description="Median time recent requests waited for a slot")
+    queue_wait_p99_ms: float = Field(..., description="99th percentile time recent requests waited for a slot")
+    service_time_p50_ms: float = Field(..., description="Median time recent requests held a slot")
+    service_time_p99_ms: float = Field(..., description="99th percentile time recent requests held a slot")
+
+class SchedulerStats(BaseModel):
+    """Statistics of the LLM request scheduler."""
+    running: int = Field(..., description="Requests currently holding a slot")
+    rejected: int = Field(..., description="Requests rejected because the user had too many pending")
+    priorities: Dict[str, PriorityStats] = Field(..., description="Statistics per priority class")
+
+class StatsResponse(BaseModel):
+    """Response model for the stats endpoint."""
+    user_count: int = Field(..., description="Number of users with chats")
+    chat_count: int = Field(..., description="Number of chats")
+    message_count: int = Field(..., description="Number of messages across all chats")
+    message_bytes: int = Field(..., description="UTF-8 size of message content across all chats")
+    daily_active_users: Dict[str, int] = Field(..., description="Estimated distinct users asking questions, per day")
+    top_users: List[TopEntry] = Field(..., description="Users who added the most messages, with estimated counts of messages added")
+    longest_chats: List[TopEntry] = Field(..., description="Chats with the most messages, with exact current message counts")
+    chat_length_histogram: Dict[str, int] = Field(..., description="Number of chats per message count range")
+    llm_usage: Optional[LLMUsage] = Field(None, description="Token usage reported by the LLM provider")
+    scheduler: Optional[SchedulerStats] = Field(None, description="LLM request scheduler statistics")
@@ -1,26 +1,305 @@
+import os
+import json
+import contextlib
+import itertools
+import asyncio
 import logging
-from typing import List, Optional, Dict
-from datetime import datetime
-from models import Chat, Message
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from datetime import date, datetime
+from models import Chat, Message, StatsResponse, TopEntry
+from utils import HyperLogLog, TopK, Histogram
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
 
+class MessageHistory:
+    """
+    Persistent (copy-on-write) message history.
+    
+    A history references the first `parent_length` messages of its parent
+    and owns only its own tail. Parent tails are append-only, so a branch's
+    view of the shared prefix never changes; truncation always creates a new
+    history node instead of mutating an existing one.
+    """
+    
+    __slots__ = ("parent", "parent_length", "parent_bytes", "tail", "_tail_bytes")
+    
+    def __init__(self, parent: "MessageHistory" = None, parent_length: int = 0, tail: List[Message] = None):
+        self.parent = parent
+        self.parent_length = parent_length if parent is not None else 0
+        self.parent_bytes = parent.byte_size_at(parent_length) if parent is not None else 0
+        self.tail: List[Message] = []
+        # Running total of content bytes over the tail, one entry per message
+        self._tail_bytes: List[int] = []
+        for message in tail or []:
+            self.append(message)
+    
+    def __len__(self) -> int:
+        return self.parent_length + len(self.tail)
+    
+    @property
+    def byte_size(self) -> int:
+        """UTF-8 size of the content of all messages in the history."""
+        return self.byte_size_at(len(self))
+    
+    def byte_size_at(self, length: int) -> int:
+        """UTF-8 size of the content of the first `length` messages."""
+        node = self
+        while node.parent is not None and length <= node.parent_length:
+            node = node.parent
+        own = length - node.parent_length
+        return node.parent_bytes + (node._tail_bytes[own - 1] if own > 0 else 0)
+    
+    def append(self, message: Message) -> None:
+        """Append a message to this history's own tail."""
+        total = self._tail_bytes[-1] if self._tail_bytes else 0
+        self._tail_bytes.append(total + len(message.content.encode("utf-8")))
+        self.tail.append(message)
+    
+    def fork(self, length: int) -> "MessageHistory":
+        """
+        Create a branch sharing the first `length` messages of this history.
+        
+        Args:
+            length: Number of leading messages the branch keeps
+            
+        Returns:
+            New history with an empty tail
+            
+        Raises:
+            ValueError: If length is out of range
+        """
+        if length < 0 or length > len(self):
+            raise ValueError(f"Cannot fork history of {len(self)} messages at {length}")
+        
+        if length == 0:
+            return MessageHistory()
+        
+        # Reference the closest ancestor that still holds the whole prefix,
+        # so chains of forks do not grow deeper than needed
+        node = self
+        while node.parent is not None and length <= node.parent_length:
+            node = node.parent
+        
+        return MessageHistory(parent=node, parent_length=length)
+    
+    def to_list(self, length: int = None) -> List[Message]:
+        """
+        Materialize the message list.
+        
+        Args:
+            length: Number of leading messages to materialize (defaults to all)
+        
+        Returns:
+            New list referencing the shared Message objects
+        """
+        segments = []
+        node, limit = self, len(self) if length is None else min(length, len(self))
+        while node is not None and limit > 0:
+            own = limit - node.parent_length
+            if own > 0:
+                segments.append(node.tail[:own])
+            limit = min(limit, node.parent_length)
+            node = node.parent
+        
+        messages = []
+        for segment in reversed(segments):
+            messages.extend(segment)
+        return messages
+
+
+class ChatStats:
+    """
+    Usage counters and streaming sketches maintained on every repository mutation.
+    
+    Totals, the chat length histogram and the longest chats are exact and
+    follow deletions and truncations. Daily active users (HyperLogLog) and
+    the heaviest users (count-min top-k, by messages added) are approximate
+    and are not reduced by deletions.
+    """
+    
+    def __init__(self, top_k: int = 10, retained_days: int = 7):
+        self.chat_count = 0
+        self.message_count = 0
+        self.message_bytes = 0
+        self.chat_lengths = Histogram()
+        self.top_k = top_k
+        self.top_users = TopK(top_k)
+        # Current length of each non-empty chat, keyed by "user_id/chat_id",
+        # and the same keys grouped by length, so the longest chats are found
+        # by walking down from the maximum length instead of scanning chats
+        self.chat_message_counts: Dict[str, int] = {}
+        self.chats_by_length: Dict[int, Set[str]] = {}
+        self.max_chat_length = 0
+        self.retained_days = retained_days
+        self.daily_active_users: Dict[date, HyperLogLog] = {}
+    
+    def chat_added(self, user_id: str, chat_id: str, history: MessageHistory) -> None:
+        """Record a new chat (created or forked)."""
+        self.chat_count += 1
+        self.message_count += len(history)
+        self.message_bytes += history.byte_size
+        self.chat_lengths.add(len(history))
+        self._set_chat_length(user_id, chat_id, len(history))
+    
+    def chat_removed(self, user_id: str, chat_id: str, history: MessageHistory) -> None:
+        """Record a deleted chat."""
+        self.chat_count -= 1
+        self.message_count -= len(history)
+        self.message_bytes -= history.byte_size
+        self.chat_lengths.add(len(history), -1)
+        self._set_chat_length(user_id, chat_id, 0)
+    
+    def chat_replaced(self, user_id: str, chat_id: str, old_history: MessageHistory, new_history: MessageHistory) -> None:
+        """Record a chat whose history was replaced (overwritten or truncated)."""
+        self.message_count += len(new_history) - len(old_history)
+        self.message_bytes += new_history.byte_size - old_history.byte_size
+        self.chat_lengths.move(len(old_history), len(new_history))
+        self._set_chat_length(user_id, chat_id, len(new_history))
+    
+    def message_added(self, user_id: str, chat_id: str, history: MessageHistory, message: Message) -> None:
+        """Record a message appended to a chat's history."""
+        self.message_count += 1
+        self.message_bytes += history.byte_size_at(len(history)) - history.byte_size_at(len(history) - 1)
+        self.chat_lengths.move(len(history) - 1, len(history))
+        self.top_users.add(user_id)
+        self._set_chat_length(user_id, chat_id, len(history))
+        
+        if message.role == "user":
+            day = message.timestamp.date() if message.timestamp else date.today()
+            if day not in self.daily_active_users:
+                self.daily_active_users[day] = HyperLogLog()
+                for old_day in sorted(self.daily_active_users)[:-self.retained_days]:
+                    del self.daily_active_users[old_day]
+            if day in self.daily_active_users:
+                self.daily_active_users[day].add(user_id)
+    
+    def _set_chat_length(self, user_id: str, chat_id: str, length: int) -> None:
+        key = f"{user_id}/{chat_id}"
+        old_length = self.chat_message_counts.pop(key, 0)
+        if old_length:
+            keys = self.chats_by_length[old_length]
+            keys.discard(key)
+            if not keys:
+                del self.chats_by_length[old_length]
+        
+        if length:
+            self.chat_message_counts[key] = length
+            self.chats_by_length.setdefault(length, set()).add(key)
+            self.max_chat_length = max(self.max_chat_length, length)
+        while self.max_chat_length and self.max_chat_length not in self.chats_by_length:
+            self.max_chat_length -= 1
+    
+    def longest_chats(self) -> List[TopEntry]:
+        """
+        Get the chats with the most messages.
+        
+        Walks down from the longest chat's length, so the cost depends on
+        that length and top_k, not on the number of chats.
+        
+        Returns:
+            Up to top_k entries, longest first
+        """
+        entries = []
+        length = self.max_chat_length
+        while length > 0 and len(entries) < self.top_k:
+            keys = self.chats_by_length.get(length, ())
+            for key in itertools.islice(keys, self.top_k - len(entries)):
+                entries.append(TopEntry(key=key, count=length))
+            length -= 1
+        return entries
+    
+    def activity_state(self) -> Dict[str, Any]:
+        """
+        Copy the activity sketches, which cannot be rebuilt from the stored chats.
+        
+        Returns:
+            JSON-serializable sketch state, for restore_activity
+        """
+        return {
+            "top_users": {
+                "rows": [list(row) for row in self.top_users.sketch.rows],
+                "candidates": dict(self.top_users.candidates)
+            },
+            "daily_active_users": {
+                day.isoformat(): sketch.registers.hex()
+                for day, sketch in self.daily_active_users.items()
+            }
+        }
+    
+    def restore_activity(self, state: Dict[str, Any]) -> None:
+        """Replace the activity sketches with a copy made by activity_state."""
+        self.top_users.sketch.rows = [list(row) for row in state["top_users"]["rows"]]
+        self.top_users.candidates = dict(state["top_users"]["candidates"])
+        self.daily_active_users = {}
+        for day, registers in state["daily_active_users"].items():
+            sketch = HyperLogLog()
+            sketch.registers = bytearray.fromhex(registers)
+            self.daily_active_users[date.fromisoformat(day)] = sketch
+    
+    def clear(self) -> None:
+        """Reset totals after all chats are removed. Activity sketches are kept."""
+        self.chat_count = 0
+        self.message_count = 0
+        self.message_bytes = 0
+        self.chat_lengths.clear()
+        self.chat_message_counts.clear()
+        self.chats_by_length.clear()
+        self.max_chat_length = 0
+    
+    def snapshot(self, user_count: int) -> StatsResponse:
+        """Build a stats response from the current counters and sketches."""
+        return StatsResponse(
+            user_count=user_count,
+            chat_count=self.chat_count,
+            message_count=self.message_count,
+            message_bytes=self.message_bytes,
+            daily_active_users={
+                day.isoformat(): sketch.count()
+                for day, sketch in sorted(self.daily_active_users.items())
+            },
+            top_users=[TopEntry(key=key, count=count) for key, count in self.top_users.top()],
+            longest_chats=self.longest_chats(),
+            chat_length_histogram=self.chat_lengths.to_dict()
+        )
+
+
 class InMemoryChatRepository:
     """
     In-memory repository for chat management.
     
     This repository provides CRUD operations for chats using in-memory storage.
     In production, this would be replaced with a proper database implementation.
+    
+    Chat metadata and message histories are stored separately. Histories are
+    `MessageHistory` nodes, so forked chats share their parent's prefix and
+    chats returned by the repository carry a materialized view of messages.
     """
     
     def __init__(self):
         """Initialize the repository with empty storage."""
         # Store chats as a nested dictionary: {user_id: {chat_id: Chat}}
         self.chats: Dict[str, Dict[str, Chat]] = {}
+        # Store message histories with the same layout: {user_id: {chat_id: MessageHistory}}
+        self.histories: Dict[str, Dict[str, MessageHistory]] = {}
+        # Counters and sketches updated on every mutation, so stats never scan
+        self.stats = ChatStats()
         logger.info("InMemoryChatRepository initialized")
     
+    def _view(self, chat: Chat) -> Chat:
+        """Return a copy of the stored chat with its messages materialized."""
+        history = self.histories[chat.user_id][chat.chat_id]
+        return chat.model_copy(update={"messages": history.to_list()})
+    
+    def _store(self, chat: Chat, history: MessageHistory) -> None:
+        """Store chat metadata (without messages) and its history."""
+        self.chats.setdefault(chat.user_id, {})[chat.chat_id] = chat.model_copy(update={"messages": []})
+        self.histories.setdefault(chat.user_id, {})[chat.chat_id] = history
+    
+    def _exists(self, user_id: str, chat_id: str) -> bool:
+        return user_id in self.chats and chat_id in self.chats[user_id]
+    
     def create_chat(self, chat: Chat) -> Chat:
         """
         Create a new chat.
@@ -34,10 +313,7 @@ class InMemoryChatRepository:
         Raises:
             ValueError: If chat with same ID already exists for the user
         """
-        if chat.user_id not in self.chats:
-            self.chats[chat.user_id] = {}
-        
-        if chat.chat_id in self.chats[chat.user_id]:
+        if self._exists(chat.user_id, chat.chat_id):
             logger.warning(f"Chat {chat.chat_id} already exists for user {chat.user_id}")
             raise ValueError(f"Chat {chat.chat_id} already exists for user {chat.user_id}")
         
@@ -45,7 +321,9 @@ class InMemoryChatRepository:
         chat.created_at = datetime.now()
         chat.updated_at = datetime.now()
         
-        self.chats[chat.user_id][chat.chat_id] = chat
+        history = MessageHistory(tail=list(chat.messages))
+        self._store(chat, history)
+        self.stats.chat_added(chat.user_id, chat.chat_id, history)
         logger.info(f"Created chat {chat.chat_id} for user {chat.user_id}")
         return chat
     
@@ -60,11 +338,11 @@ class InMemoryChatRepository:
         Returns:
             Chat object if found, None otherwise
         """
-        if user_id not in self.chats or chat_id not in self.chats[user_id]:
+        if not self._exists(user_id, chat_id):
             logger.debug(f"Chat {chat_id} not found for user {user_id}")
             return None
         
-        chat = self.chats[user_id][chat_id]
+        chat = self._view(self.chats[user_id][chat_id])
         logger.debug(f"Retrieved chat {chat_id} for user {user_id}")
         return chat
     
@@ -82,7 +360,7 @@ class InMemoryChatRepository:
             logger.debug(f"No chats found for user {user_id}")
             return []
         
-        chats = list(self.chats[user_id].values())
+        chats = [self._view(chat) for chat in self.chats[user_id].values()]
         logger.debug(f"Retrieved {len(chats)} chats for user {user_id}")
         return chats
     
@@ -90,6 +368,9 @@ class InMemoryChatRepository:
         """
         Update an existing chat.
         
+        The chat's messages replace its stored history. Forks of the chat keep
+        referencing the previous history.
+        
         Args:
             chat: Updated chat object
             
@@ -99,14 +380,17 @@ class InMemoryChatRepository:
         Raises:
             ValueError: If chat doesn't exist
         """
-        if chat.user_id not in self.chats or chat.chat_id not in self.chats[chat.user_id]:
+        if not self._exists(chat.user_id, chat.chat_id):
             logger.warning(f"Cannot update chat {chat.chat_id} for user {chat.user_id} - not found")
             raise ValueError(f"Chat {chat.chat_id} not found for user {chat.user_id}")
         
         # Update timestamp
         chat.updated_at = datetime.now()
         
-        self.chats[chat.user_id][chat.chat_id] = chat
+        old_history = self.histories[chat.user_id][chat.chat_id]
+        history = MessageHistory(tail=list(chat.messages))
+        self._store(chat, history)
+        self.stats.chat_replaced(chat.user_id, chat.chat_id, old_history, history)
         logger.info(f"Updated chat {chat.chat_id} for user {chat.user_id}")
         return chat
     
@@ -125,7 +409,7 @@ class InMemoryChatRepository:
         Raises:
             ValueError: If chat doesn't exist
         """
-        if user_id not in self.chats or chat_id not in self.chats[user_id]:
+        if not self._exists(user_id, chat_id):
             logger.warning(f"Cannot update title for chat {chat_id} - not found")
             raise ValueError(f"Chat {chat_id} not found for user {user_id}")
         
@@ -134,7 +418,7 @@ class InMemoryChatRepository:
         chat.updated_at = datetime.now()
         
         logger.info(f"Updated title for chat {chat_id} to '{new_title}'")
-        return chat
+        return self._view(chat)
     
     def add_message_to_chat(self, user_id: str, chat_id: str, message: Message) -> Chat:
         """
@@ -151,21 +435,154 @@ class InMemoryChatRepository:
         Raises:
             ValueError: If chat doesn't exist
         """
-        if user_id not in self.chats or chat_id not in self.chats[user_id]:
+        self.append_message(user_id, chat_id, message)
+        return self._view(self.chats[user_id][chat_id])
+    
+    def append_message(self, user_id: str, chat_id: str, message: Message) -> MessageHistory:
+        """
+        Add a message to a specific chat without materializing its messages.
+        
+        Args:
+            user_id: User identifier
+            chat_id: Chat identifier
+            message: Message to add
+            
+        Returns:
+            The chat's message history
+            
+        Raises:
+            ValueError: If chat doesn't exist
+        """
+        if not self._exists(user_id, chat_id):
             logger.warning(f"Cannot add message to chat {chat_id} - not found")
             raise ValueError(f"Chat {chat_id} not found for user {user_id}")
         
+        history = self.histories[user_id][chat_id]
+        history.append(message)
+        self.chats[user_id][chat_id].updated_at = datetime.now()
+        self.stats.message_added(user_id, chat_id, history, message)
+        
+        logger.info(f"Added message to chat {chat_id} for user {user_id}")
+        return history
+    
+    def chat_exists(self, user_id: str, chat_id: str) -> bool:
+        """
+        Check whether a chat exists without materializing its messages.
+        
+        Args:
+            user_id: User identifier
+            chat_id: Chat identifier
+            
+        Returns:
+            True if the chat exists
+        """
+        return self._exists(user_id, chat_id)
+    
+    def get_message_history(self, user_id: str, chat_id: str) -> Optional[MessageHistory]:
+        """
+        Get the message history node of a specific chat.
+        
+        The node is replaced whenever the chat is truncated or overwritten,
+        so callers caching a view can compare it by identity and length.
+        
+        Args:
+            user_id: User identifier
+            chat_id: Chat identifier
+            
+        Returns:
+            MessageHistory if the chat exists, None otherwise
+        """
+        if not self._exists(user_id, chat_id):
+            return None
+        return self.histories[user_id][chat_id]
+    
+    def fork_chat(self, user_id: str, chat_id: str, new_chat_id: str,
+                  message_count: int = None, title: str = None) -> Chat:
+        """
+        Fork a chat into a new chat sharing its message prefix.
+        
+        The fork references the source history instead of copying it, and
+        stays valid if the source chat is later deleted or truncated.
+        
+        Args:
+            user_id: User identifier
+            chat_id: Source chat identifier
+            new_chat_id: Identifier for the forked chat
+            message_count: Number of leading messages to keep (defaults to all)
+            title: Title for the forked chat
+            
+        Returns:
+            Forked chat object
+            
+        Raises:
+            ValueError: If the source chat doesn't exist, the target already
+                exists or message_count is out of range
+        """
+        if not self._exists(user_id, chat_id):
+            logger.warning(f"Cannot fork chat {chat_id} - not found")
+            raise ValueError(f"Chat {chat_id} not found for user {user_id}")
+        
+        if self._exists(user_id, new_chat_id):
+            logger.warning(f"Chat {new_chat_id} already exists for user {user_id}")
+            raise ValueError(f"Chat {new_chat_id} already exists for user {user_id}")
+        
+        source_history = self.histories[user_id][chat_id]
+        length = len(source_history) if message_count is None else message_count
+        history = source_history.fork(length)
+        
+        now = datetime.now()
+        new_chat = Chat(
+            chat_id=new_chat_id,
+            user_id=user_id,
+            title=title or f"Chat {new_chat_id}",
+            parent_chat_id=chat_id,
+            created_at=now,
+            updated_at=now
+        )
+        self._store(new_chat, history)
+        self.stats.chat_added(user_id, new_chat_id, history)
+        
+        logger.info(f"Forked chat {chat_id} into {new_chat_id} at message {length} for user {user_id}")
+        return self._view(new_chat)
+    
+    def truncate_chat(self, user_id: str, chat_id: str, message_count: int) -> Chat:
+        """
+        Keep only the first `message_count` messages of a chat.
+        
+        The chat is moved onto a new history branch, so forks sharing the
+        dropped messages are unaffected.
+        
+        Args:
+            user_id: User identifier
+            chat_id: Chat identifier
+            message_count: Number of leading messages to keep
+            
+        Returns:
+            Updated chat object
+            
+        Raises:
+            ValueError: If chat doesn't exist or message_count is out of range
+        """
+        if not self._exists(user_id, chat_id):
+            logger.warning(f"Cannot truncate chat {chat_id} - not found")
+            raise ValueError(f"Chat {chat_id} not found for user {user_id}")
+        
         chat = self.chats[user_id][chat_id]
-        chat.messages.append(message)
+        old_history = self.histories[user_id][chat_id]
+        history = old_history.fork(message_count)
+        self.histories[user_id][chat_id] = history
+        self.stats.chat_replaced(user_id, chat_id, old_history, history)
         chat.updated_at = datetime.now()
         
-        logger.info(f"Added message to chat {chat_id} for user {user_id}")
-        return chat
+        logger.info(f"Truncated chat {chat_id} to {message_count} messages for user {user_id}")
+        return self._view(chat)
     
     def delete_chat(self, user_id: str, chat_id: str) -> bool:
         """
         Delete a specific chat for a user.
         
+        Forks of the chat keep their own reference to the shared history.
+        
         Args:
             user_id: User identifier
             chat_id: Chat identifier
@@ -173,15 +590,17 @@ class InMemoryChatRepository:
         Returns:
             True if chat was deleted, False if not found
         """
-        if user_id not in self.chats or chat_id not in self.chats[user_id]:
+        if not self._exists(user_id, chat_id):
             logger.warning(f"Cannot delete chat {chat_id} - not found")
             return False
         
         del self.chats[user_id][chat_id]
+        self.stats.chat_removed(user_id, chat_id, self.histories[user_id].pop(chat_id))
         
         # If user has no more chats, remove user entry
         if not self.chats[user_id]:
             del self.chats[user_id]
+            del self.histories[user_id]
         
         logger.info(f"Deleted chat {chat_id} for user {user_id}")
         return True
@@ -202,6 +621,8 @@ class InMemoryChatRepository:
         
         deleted_count = len(self.chats[user_id])
         del self.chats[user_id]
+        for chat_id, history in self.histories.pop(user_id).items():
+            self.stats.chat_removed(user_id, chat_id, history)
         
         logger.info(f"Deleted {deleted_count} chats for user {user_id}")
         return deleted_count
@@ -245,7 +666,7 @@ class InMemoryChatRepository:
         """
         all_chats = []
         for user_chats in self.chats.values():
-            all_chats.extend(user_chats.values())
+            all_chats.extend(self._view(chat) for chat in user_chats.values())
         
         logger.debug(f"Retrieved {len(all_chats)} total chats")
         return all_chats
@@ -265,7 +686,7 @@ class InMemoryChatRepository:
             logger.debug(f"User {user_id} has {count} chats")
             return count
         
-        total_count = sum(len(user_chats) for user_chats in self.chats.values())
+        total_count = self.stats.chat_count
         logger.debug(f"Total chat count: {total_count}")
         return total_count
     
@@ -280,6 +701,19 @@ class InMemoryChatRepository:
         logger.debug(f"User count: {count}")
         return count
     
+    def get_stats(self) -> StatsResponse:
+        """
+        Get usage statistics.
+        
+        Served from counters, sketches and a chat length index maintained on
+        each mutation, so the cost does not depend on the number of chats or
+        messages.
+        
+        Returns:
+            Current statistics
+        """
+        return self.stats.snapshot(user_count=len(self.chats))
+    
     def clear_all_chats(self) -> int:
         """
         Clear all chats from the repository.
@@ -287,8 +721,10 @@ class InMemoryChatRepository:
         Returns:
             Number of chats cleared
         """
-        total_count = sum(len(user_chats) for user_chats in self.chats.values())
+        total_count = self.stats.chat_count
         self.chats.clear()
+        self.histories.clear()
+        self.stats.clear()
         
         logger.warning(f"Cleared all {total_count} chats from repository")
         return total_count
@@ -312,13 +748,577 @@ class InMemoryChatRepository:
             if user_id in self.chats:
                 for chat in self.chats[user_id].values():
                     if title_query_lower in chat.title.lower():
-                        matching_chats.append(chat)
+                        matching_chats.append(self._view(chat))
         else:
             # Search in all chats
             for user_chats in self.chats.values():
                 for chat in user_chats.values():
                     if title_query_lower in chat.title.lower():
-                        matching_chats.append(chat)
+                        matching_chats.append(self._view(chat))
         
         logger.debug(f"Found {len(matching_chats)} chats matching title query '{title_query}'")
         return matching_chats
+    
+    def start(self) -> None:
+        """Start background work. Nothing to do for in-memory storage."""
+    
+    async def commit(self) -> None:
+        """Wait until previous mutations are durable. In-memory writes apply immediately."""
+    
+    async def close(self) -> None:
+        """Flush pending work and stop background work. Nothing to do for in-memory storage."""
+
+
+class WriteBufferFullError(Exception):
+    """Raised when a write-behind repository cannot buffer more mutations."""
+    
+    def __init__(self, limit: int):
+        super().__init__(f"Too many mutations waiting to be persisted (limit {limit})")
+        self.limit = limit
+
+
+class JsonlChatStore:
+    """
+    JSON lines journal of repository mutations.
+    
+    Each committed batch is appended with a single fsync. A batch is either
+    fully committed or not at all: bytes written by a failed commit are
+    removed, so retrying the batch does not duplicate or corrupt records.
+    `rewrite` atomically replaces the whole journal, which is how it is
+    compacted into a snapshot.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        # Journal size after the last successful commit
+        self._committed_size: Optional[int] = None
+        logger.info(f"JsonlChatStore initialized at {path}")
+    
+    def commit(self, mutations: List[Dict[str, Any]]) -> None:
+        """
+        Durably append a batch of mutations.
+        
+        Args:
+            mutations: Mutation records to append
+            
+        Raises:
+            OSError: If the batch could not be written and synced; the
+                journal is left as it was before the call
+        """
+        payload = "".join(json.dumps(mutation) + "\n" for mutation in mutations).encode("utf-8")
+        with open(self.path, "ab", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if self._committed_size is None:
+                self._committed_size = size
+            elif size > self._committed_size:
+                # A previous failed commit could not remove what it wrote
+                logger.warning(f"Removing {size - self._committed_size} bytes of a failed commit from {self.path}")
+                f.truncate(self._committed_size)
+            
+            try:
+                written = 0
+                while written < len(payload):
+                    written += f.write(payload[written:])
+                os.fsync(f.fileno())
+            except BaseException:
+                try:
+                    f.truncate(self._committed_size)
+                except OSError as e:
+                    logger.error(f"Failed to remove a partial commit from {self.path}: {e}")
+                raise
+        self._committed_size += len(payload)
+    
+    def rewrite(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Durably replace the journal with the given records.
+        
+        The records are written to a temporary file which then atomically
+        replaces the journal, so a failure leaves the old journal intact.
+        
+        Args:
+            records: Records of the new journal, in replay order
+            
+        Returns:
+            Number of records written
+        """
+        temporary_path = f"{self.path}.tmp"
+        count = 0
+        try:
+            with open(temporary_path, "wb") as f:
+                for record in records:
+                    f.write(json.dumps(record).encode("utf-8") + b"\n")
+                    count += 1
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temporary_path)
+            raise
+        
+        # Make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._committed_size = size
+        return count
+    
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        Read back all committed mutations in order.
+        
+        A final record left incomplete by a crash during commit is logged and
+        truncated away; it was never acknowledged as durable. The journal is
+        read one line at a time.
+        
+        Yields:
+            Mutation records
+            
+        Raises:
+            ValueError: If a record other than the last one is corrupt
+        """
+        if not os.path.exists(self.path):
+            self._committed_size = 0
+            return
+        
+        offset = 0
+        with open(self.path, "rb") as f:
+            for number, line in enumerate(f, start=1):
+                try:
+                    # Every committed record ends with a newline
+                    if not line.endswith(b"\n"):
+                        raise ValueError("missing end of line")
+                    record = json.loads(line) if line.strip() else None
+                except ValueError:
+                    if f.read(1):
+                        raise ValueError(f"Corrupt record at line {number} of {self.path}")
+                    logger.warning(f"Truncating incomplete last record at line {number} of {self.path}")
+                    with open(self.path, "r+b") as journal:
+                        journal.truncate(offset)
+                        os.fsync(journal.fileno())
+                    break
+                offset += len(line)
+                if record is not None:
+                    yield record
+        self._committed_size = offset
+
+
+def _snapshot_records(chats: List[Tuple[Dict[str, Any], MessageHistory, int]],
+                      activity: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Build journal records recreating the given chats.
+    
+    History nodes are written once each, parents first, so forks keep
+    sharing their prefix after a restart. Messages of a node that no chat
+    can reach any more are left out.
+    
+    Args:
+        chats: (chat metadata, history, length) per chat, captured together
+        activity: Activity sketch state from ChatStats.activity_state
+        
+    Yields:
+        snapshot_history, snapshot_chat and snapshot_activity records
+    """
+    # Number of tail messages of each node reachable from some chat
+    needed: Dict[MessageHistory, int] = {}
+    for _, history, length in chats:
+        node, limit = history, length
+        while node is not None:
+            own = limit - node.parent_length
+            if needed.get(node, -1) >= own:
+                # Already covered, and so are its ancestors
+                break
+            needed[node] = own
+            limit = node.parent_length
+            node = node.parent
+    
+    node_ids: Dict[MessageHistory, int] = {}
+    for _, history, _ in chats:
+        # Write the ancestors not written yet, oldest first
+        pending = []
+        node = history
+        while node is not None and node not in node_ids:
+            pending.append(node)
+            node = node.parent
+        for node in reversed(pending):
+            node_ids[node] = len(node_ids)
+            yield {
+                "op": "snapshot_history",
+                "id": node_ids[node],
+                "parent": node_ids[node.parent] if node.parent is not None else None,
+                "parent_length": node.parent_length,
+                "messages": [message.model_dump(mode="json") for message in node.tail[:needed[node]]]
+            }
+    
+    for chat, history, _ in chats:
+        yield {"op": "snapshot_chat", "chat": chat, "history": node_ids[history]}
+    yield {"op": "snapshot_activity", **activity}
+
+
+class WriteBehindChatRepository(InMemoryChatRepository):
+    """
+    In-memory repository with write-behind persistence to a durable store.
+    
+    Mutations are applied in memory (so reads see them immediately) and
+    queued as records. A background task commits queued records to the
+    store in batches, every `flush_interval` seconds or as soon as
+    `batch_size` records are pending, so many requests share one durable
+    write.
+    
+    With durability "before", writes are acknowledged once buffered. With
+    durability "after", `commit()` waits until the caller's writes have been
+    flushed.
+    
+    Once `compact_threshold` records have been appended since the last
+    snapshot (and at least as many as the snapshot holds), the journal is
+    replaced by a snapshot of the current state, so disk use and replay
+    time follow the live data rather than the mutation history. Capturing
+    the snapshot walks every chat on the event loop; writing it runs in a
+    worker thread.
+    
+    A failed flush keeps the batch and retries it with exponential backoff,
+    up to `max_retry_interval` seconds apart. While the store is failing,
+    at most `max_buffer_size` records are buffered; further mutations are
+    rejected with WriteBufferFullError before they are applied.
+    """
+    
+    DURABILITY_MODES = ("before", "after")
+    
+    def __init__(self, store: JsonlChatStore, flush_interval: float = 0.005,
+                 batch_size: int = 256, durability: str = "before",
+                 max_buffer_size: int = 100000, max_retry_interval: float = 5.0,
+                 compact_threshold: int = 100000):
+        """
+        Initialize the repository and replay the store's journal.
+        
+        A compact_threshold of 0 disables compaction.
+        
+        Raises:
+            ValueError: If durability is not a known mode
+        """
+        if durability not in self.DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        
+        super().__init__()
+        self.store = store
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.durability = durability
+        self.max_buffer_size = max_buffer_size
+        self.max_retry_interval = max_retry_interval
+        self.compact_threshold = compact_threshold
+        
+        self._buffer: List[Dict[str, Any]] = []
+        # Consecutive failed flushes, used for the retry backoff
+        self._failures = 0
+        # Journal records in the last snapshot and appended after it
+        self._snapshot_records = 0
+        self._appended_records = 0
+        # History nodes of the snapshot being replayed, by record id
+        self._snapshot_histories: Dict[int, MessageHistory] = {}
+        # Sequence numbers of the last buffered and last flushed record
+        self._sequence = 0
+        self._flushed_sequence = 0
+        self._waiters: List[tuple] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+        self._replaying = False
+        
+        self._replay()
+        logger.info(f"WriteBehindChatRepository initialized (interval={flush_interval}s, batch={batch_size}, durability={durability})")
+    
+    def _record(self, op: str, **fields) -> None:
+        """Queue a mutation record for the next flush."""
+        if self._replaying:
+            return
+        
+        self._buffer.append({"op": op, **fields})
+        self._sequence += 1
+        # A failing store is retried on the backoff schedule, not per full batch
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None and not self._failures:
+            self._wakeup.set()
+    
+    def _check_buffer(self) -> None:
+        """
+        Refuse new mutations while the buffer is full.
+        
+        Raises:
+            WriteBufferFullError: If max_buffer_size records are waiting
+        """
+        if len(self._buffer) >= self.max_buffer_size:
+            logger.warning(f"Rejecting mutation: {len(self._buffer)} records waiting to be persisted")
+            raise WriteBufferFullError(self.max_buffer_size)
+    
+    def _replay(self) -> None:
+        """Rebuild in-memory state from the store's journal."""
+        self._replaying = True
+        try:
+            for record in self.store.replay():
+                self._apply(record)
+                if record["op"].startswith("snapshot_"):
+                    self._snapshot_records += 1
+                else:
+                    self._appended_records += 1
+        finally:
+            self._replaying = False
+            self._snapshot_histories = {}
+        logger.info(f"Replayed {self._snapshot_records} snapshot records and {self._appended_records} mutations from store")
+    
+    def _apply(self, record: Dict[str, Any]) -> None:
+        """Apply a journaled mutation to the in-memory state."""
+        op = record["op"]
+        if op in ("create_chat", "update_chat"):
+            chat = Chat.model_validate(record["chat"])
+            getattr(self, op)(chat)
+            stored = self.chats[chat.user_id][chat.chat_id]
+            stored.created_at = datetime.fromisoformat(record["chat"]["created_at"])
+            stored.updated_at = datetime.fromisoformat(record["chat"]["updated_at"])
+        elif op == "update_chat_title":
+            self.update_chat_title(record["user_id"], record["chat_id"], record["title"])
+            self._restore_timestamps(record["user_id"], record["chat_id"], record)
+        elif op == "append_message":
+            message = Message.model_validate(record["message"])
+            self.append_message(record["user_id"], record["chat_id"], message)
+            self._restore_timestamps(record["user_id"], record["chat_id"], record)
+        elif op == "fork_chat":
+            self.fork_chat(record["user_id"], record["chat_id"], record["new_chat_id"],
+                           message_count=record["message_count"], title=record["title"])
+            self._restore_timestamps(record["user_id"], record["new_chat_id"], record)
+        elif op == "truncate_chat":
+            self.truncate_chat(record["user_id"], record["chat_id"], record["message_count"])
+            self._restore_timestamps(record["user_id"], record["chat_id"], record)
+        elif op == "delete_chat":
+            self.delete_chat(record["user_id"], record["chat_id"])
+        elif op == "delete_user_chats":
+            self.delete_user_chats(record["user_id"])
+        elif op == "clear_all_chats":
+            self.clear_all_chats()
+        elif op == "snapshot_history":
+            parent = self._snapshot_histories[record["parent"]] if record["parent"] is not None else None
+            messages = [Message.model_validate(message) for message in record["messages"]]
+            self._snapshot_histories[record["id"]] = MessageHistory(
+                parent=parent, parent_length=record["parent_length"], tail=messages
+            )
+        elif op == "snapshot_chat":
+            chat = Chat.model_validate(record["chat"])
+            history = self._snapshot_histories[record["history"]]
+            self._store(chat, history)
+            self.stats.chat_added(chat.user_id, chat.chat_id, history)
+        elif op == "snapshot_activity":
+            self.stats.restore_activity(record)
+        else:
+            logger.warning(f"Skipping unknown mutation in store: {op}")
+    
+    def _timestamps(self, user_id: str, chat_id: str) -> Dict[str, str]:
+        """Journal fields holding the stored chat's timestamps."""
+        chat = self.chats[user_id][chat_id]
+        return {"created_at": chat.created_at.isoformat(), "updated_at": chat.updated_at.isoformat()}
+    
+    def _restore_timestamps(self, user_id: str, chat_id: str, record: Dict[str, Any]) -> None:
+        """Set the stored chat's timestamps from a journal record, if it has them."""
+        chat = self.chats[user_id][chat_id]
+        if "created_at" in record:
+            chat.created_at = datetime.fromisoformat(record["created_at"])
+        if "updated_at" in record:
+            chat.updated_at = datetime.fromisoformat(record["updated_at"])
+    
+    def create_chat(self, chat: Chat) -> Chat:
+        self._check_buffer()
+        chat = super().create_chat(chat)
+        self._record("create_chat", chat=chat.model_dump(mode="json"))
+        return chat
+    
+    def update_chat(self, chat: Chat) -> Chat:
+        self._check_buffer()
+        chat = super().update_chat(chat)
+        self._record("update_chat", chat=chat.model_dump(mode="json"))
+        return chat
+    
+    def update_chat_title(self, user_id: str, chat_id: str, new_title: str) -> Chat:
+        self._check_buffer()
+        chat = super().update_chat_title(user_id, chat_id, new_title)
+        self._record("update_chat_title", user_id=user_id, chat_id=chat_id, title=new_title,
+                     **self._timestamps(user_id, chat_id))
+        return chat
+    
+    def append_message(self, user_id: str, chat_id: str, message: Message) -> MessageHistory:
+        self._check_buffer()
+        history = super().append_message(user_id, chat_id, message)
+        self._record("append_message", user_id=user_id, chat_id=chat_id,
+                     message=message.model_dump(mode="json"), **self._timestamps(user_id, chat_id))
+        return history
+    
+    def fork_chat(self, user_id: str, chat_id: str, new_chat_id: str,
+                  message_count: int = None, title: str = None) -> Chat:
+        self._check_buffer()
+        chat = super().fork_chat(user_id, chat_id, new_chat_id, message_count=message_count, title=title)
+        self._record("fork_chat", user_id=user_id, chat_id=chat_id, new_chat_id=new_chat_id,
+                     message_count=len(chat.messages), title=chat.title,
+                     **self._timestamps(user_id, new_chat_id))
+        return chat
+    
+    def truncate_chat(self, user_id: str, chat_id: str, message_count: int) -> Chat:
+        self._check_buffer()
+        chat = super().truncate_chat(user_id, chat_id, message_count)
+        self._record("truncate_chat", user_id=user_id, chat_id=chat_id, message_count=message_count,
+                     **self._timestamps(user_id, chat_id))
+        return chat
+    
+    def delete_chat(self, user_id: str, chat_id: str) -> bool:
+        self._check_buffer()
+        deleted = super().delete_chat(user_id, chat_id)
+        if deleted:
+            self._record("delete_chat", user_id=user_id, chat_id=chat_id)
+        return deleted
+    
+    def delete_user_chats(self, user_id: str) -> int:
+        self._check_buffer()
+        deleted_count = super().delete_user_chats(user_id)
+        if deleted_count:
+            self._record("delete_user_chats", user_id=user_id)
+        return deleted_count
+    
+    def clear_all_chats(self) -> int:
+        self._check_buffer()
+        total_count = super().clear_all_chats()
+        self._record("clear_all_chats")
+        return total_count
+    
+    def start(self) -> None:
+        """Start the background flush task on the running event loop."""
+        if self._flusher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        logger.info("Write-behind flusher started")
+    
+    async def commit(self) -> None:
+        """
+        Wait until all mutations made so far are durable.
+        
+        Returns immediately with durability "before". Otherwise the caller
+        joins the next group commit.
+        """
+        if self.durability == "before" or self._flushed_sequence >= self._sequence:
+            return
+        
+        if self._flusher is None:
+            # No background task (e.g. outside the app lifespan): flush inline
+            await self._flush()
+            return
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((self._sequence, waiter))
+        await waiter
+    
+    async def close(self) -> None:
+        """Stop the background flush task and flush everything still buffered."""
+        if self._flusher is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._flusher
+            self._flusher = None
+            self._wakeup = None
+            self._closing = False
+        
+        await self._flush()
+        logger.info("Write-behind flusher stopped")
+    
+    def _retry_delay(self) -> float:
+        """Seconds until the next flush: the flush interval, doubled per consecutive failure."""
+        if not self._failures:
+            return self.flush_interval
+        return min(self.flush_interval * 2 ** min(self._failures, 30), self.max_retry_interval)
+    
+    async def _flush_loop(self) -> None:
+        """Flush the buffer every interval, or sooner when a batch is full."""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._retry_delay())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+    
+    async def _flush(self) -> None:
+        """Commit buffered mutations to the store as one batch."""
+        if not self._buffer:
+            return
+        
+        batch, self._buffer = self._buffer, []
+        batch_sequence = self._sequence
+        try:
+            await asyncio.to_thread(self.store.commit, batch)
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"Failed to flush {len(batch)} mutations (attempt {self._failures}), "
+                         f"retrying in {self._retry_delay():.3f}s: {e}")
+            # Keep the batch ahead of newer mutations; waiters are released
+            # with the error since their writes are not durable yet
+            self._buffer = batch + self._buffer
+            waiters, self._waiters = self._waiters, []
+            for _, waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        
+        if self._failures:
+            logger.info(f"Store recovered after {self._failures} failed flushes")
+            self._failures = 0
+        self._appended_records += len(batch)
+        self._release_waiters(batch_sequence)
+        logger.debug(f"Flushed {len(batch)} mutations")
+        
+        if (self.compact_threshold and self._appended_records >= self.compact_threshold
+                and self._appended_records >= self._snapshot_records):
+            await self._compact()
+    
+    def _release_waiters(self, flushed_sequence: int) -> None:
+        """Mark records up to a sequence number as durable and wake their committers."""
+        self._flushed_sequence = flushed_sequence
+        remaining = []
+        for sequence, waiter in self._waiters:
+            if sequence <= flushed_sequence:
+                if not waiter.done():
+                    waiter.set_result(None)
+            else:
+                remaining.append((sequence, waiter))
+        self._waiters = remaining
+    
+    async def _compact(self) -> None:
+        """Replace the store's journal with a snapshot of the current state."""
+        # The snapshot includes every mutation buffered so far
+        batch, self._buffer = self._buffer, []
+        batch_sequence = self._sequence
+        chats = [
+            ({
+                "user_id": chat.user_id,
+                "chat_id": chat.chat_id,
+                "title": chat.title,
+                "created_at": chat.created_at.isoformat(),
+                "updated_at": chat.updated_at.isoformat(),
+                "parent_chat_id": chat.parent_chat_id
+            }, self.histories[user_id][chat_id], len(self.histories[user_id][chat_id]))
+            for user_id, user_chats in self.chats.items()
+            for chat_id, chat in user_chats.items()
+        ]
+        activity = self.stats.activity_state()
+        
+        try:
+            count = await asyncio.to_thread(self.store.rewrite, _snapshot_records(chats, activity))
+        except Exception as e:
+            # Keep appending to the old journal; try again after another threshold
+            logger.error(f"Failed to compact the journal: {e}")
+            self._buffer = batch + self._buffer
+            self._appended_records = 0
+            return
+        
+        logger.info(f"Compacted {self._snapshot_records + self._appended_records} journal records "
+                    f"into a snapshot of {count} records")
+        self._snapshot_records = count
+        self._appended_records = 0
+        self._release_waiters(batch_sequence)
@@ -0,0 +1,245 @@
+import math
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from models import SchedulerStats, PriorityStats
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a user already has the maximum number of pending requests."""
+
+    def __init__(self, user_id: str, limit: int):
+        super().__init__(f"Too many pending requests for user {user_id} (limit {limit})")
+        self.user_id = user_id
+        self.limit = limit
+
+
+class Ticket:
+    """A request admitted by the scheduler, with its timing."""
+
+    def __init__(self, user_id: str, priority: str):
+        self.user_id = user_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def queue_wait(self) -> float:
+        """Seconds spent waiting for a slot."""
+        return (self.started_at or time.monotonic()) - self.enqueued_at
+
+    @property
+    def service_time(self) -> float:
+        """Seconds spent holding a slot."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+class _QueueEntry:
+    __slots__ = ("finish_tag", "sequence", "start_tag", "ticket", "future")
+
+    def __init__(self, finish_tag: float, sequence: int, start_tag: float, ticket: Ticket, future: asyncio.Future):
+        self.finish_tag = finish_tag
+        self.sequence = sequence
+        self.start_tag = start_tag
+        self.ticket = ticket
+        self.future = future
+
+    def __lt__(self, other: "_QueueEntry") -> bool:
+        return (self.finish_tag, self.sequence) < (other.finish_tag, other.sequence)
+
+
+def _percentile(values: Deque[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FairScheduler:
+    """
+    Admission scheduler for LLM-bound work.
+
+    At most `max_concurrency` requests run at once. Waiting requests are
+    served by priority class first ("interactive" before "batch"), and
+    within a class by weighted fair queuing across users (start-time fair
+    queuing with one unit of work per request), so a user with many queued
+    requests cannot delay other users' requests by more than one request
+    each. A user with `max_pending_per_user` requests queued or running is
+    rejected immediately with QueueFullError.
+    """
+
+    PRIORITIES = ("interactive", "batch")
+
+    def __init__(self, max_concurrency: int = 16, max_pending_per_user: int = 8,
+                 user_weights: Dict[str, float] = None, history_size: int = 1024):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrency: Requests allowed to run at once
+            max_pending_per_user: Requests a user may have queued or running
+            user_weights: Share of each user relative to the default weight of 1.0
+            history_size: Recent requests kept per class for percentiles
+
+        Raises:
+            ValueError: If a user weight is not a positive finite number
+        """
+        for weight_user_id, weight in (user_weights or {}).items():
+            if not (weight > 0 and math.isfinite(weight)):
+                raise ValueError(f"Weight for user {weight_user_id} must be a positive number, got {weight}")
+
+        self.max_concurrency = max_concurrency
+        self.max_pending_per_user = max_pending_per_user
+        self.user_weights = user_weights or {}
+
+        self._queues: Dict[str, List[_QueueEntry]] = {priority: [] for priority in self.PRIORITIES}
+        self._virtual_time: Dict[str, float] = {priority: 0.0 for priority in self.PRIORITIES}
+        # Finish tag of each user's last queued request, per priority class
+        self._last_finish: Dict[str, Dict[str, float]] = {priority: {} for priority in self.PRIORITIES}
+        self._pending: Dict[str, int] = {}
+        self._running = 0
+        self._sequence = itertools.count()
+
+        self._rejected = 0
+        self._queue_waits: Dict[str, Deque[float]] = {p: deque(maxlen=history_size) for p in self.PRIORITIES}
+        self._service_times: Dict[str, Deque[float]] = {p: deque(maxlen=history_size) for p in self.PRIORITIES}
+        logger.info(f"FairScheduler initialized (concurrency={max_concurrency}, pending per user={max_pending_per_user})")
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, priority: str = "interactive") -> AsyncIterator[Ticket]:
+        """
+        Hold an execution slot for the duration of the block.
+
+        Args:
+            user_id: User the work is done for
+            priority: Priority class, one of PRIORITIES
+
+        Yields:
+            Ticket with the request's timing
+
+        Raises:
+            QueueFullError: If the user has too many pending requests
+            ValueError: If priority is unknown
+        """
+        ticket = await self.acquire(user_id, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, user_id: str, priority: str = "interactive") -> Ticket:
+        """
+        Wait for an execution slot. Each acquired ticket must be released.
+
+        Raises:
+            QueueFullError: If the user has too many pending requests
+            ValueError: If priority is unknown
+        """
+        if priority not in self.PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+
+        if self._pending.get(user_id, 0) >= self.max_pending_per_user:
+            self._rejected += 1
+            logger.warning(f"Rejecting request for user {user_id}: {self.max_pending_per_user} requests pending")
+            raise QueueFullError(user_id, self.max_pending_per_user)
+
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        ticket = Ticket(user_id, priority)
+
+        # Start-time fair queuing: a request starts no earlier than the
+        # class's virtual time or the end of the user's previous request
+        weight = self.user_weights.get(user_id, 1.0)
+        start_tag = max(self._virtual_time[priority], self._last_finish[priority].get(user_id, 0.0))
+        finish_tag = start_tag + 1.0 / weight
+        self._last_finish[priority][user_id] = finish_tag
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues[priority], _QueueEntry(finish_tag, next(self._sequence), start_tag, ticket, future))
+        # Grants the slot right away when one is free
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before cancellation; hand it on
+                self._running -= 1
+                self._dispatch()
+            self._finish_pending(user_id)
+            raise
+
+        self._start(ticket)
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """Release a ticket's slot and admit the next waiting request."""
+        ticket.finished_at = time.monotonic()
+        self._service_times[ticket.priority].append(ticket.service_time)
+        self._running -= 1
+        self._finish_pending(ticket.user_id)
+        self._dispatch()
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.started_at = time.monotonic()
+        self._queue_waits[ticket.priority].append(ticket.queue_wait)
+
+    def _finish_pending(self, user_id: str) -> None:
+        self._pending[user_id] -= 1
+        if not self._pending[user_id]:
+            del self._pending[user_id]
+            for last_finish in self._last_finish.values():
+                last_finish.pop(user_id, None)
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiting requests, highest priority and smallest finish tag first."""
+        while self._running < self.max_concurrency:
+            entry = self._pop_next()
+            if entry is None:
+                return
+            self._running += 1
+            entry.future.set_result(None)
+
+    def _pop_next(self) -> Optional[_QueueEntry]:
+        for priority in self.PRIORITIES:
+            queue = self._queues[priority]
+            while queue:
+                entry = heapq.heappop(queue)
+                # Skip requests whose caller gave up while waiting
+                if entry.future.done():
+                    continue
+                self._virtual_time[priority] = max(self._virtual_time[priority], entry.start_tag)
+                return entry
+        return None
+
+    def get_stats(self) -> SchedulerStats:
+        """
+        Get queue depths and queue-wait / service-time percentiles per priority class.
+
+        Percentiles cover the most recent requests of each class.
+        """
+        return SchedulerStats(
+            running=self._running,
+            rejected=self._rejected,
+            priorities={
+                priority: PriorityStats(
+                    queued=sum(1 for entry in self._queues[priority] if not entry.future.done()),
+                    queue_wait_p50_ms=_percentile(self._queue_waits[priority], 0.5) * 1000,
+                    queue_wait_p99_ms=_percentile(self._queue_waits[priority], 0.99) * 1000,
+                    service_time_p50_ms=_percentile(self._service_times[priority], 0.5) * 1000,
+                    service_time_p99_ms=_percentile(self._service_times[priority], 0.99) * 1000
+                )
+                for priority in self.PRIORITIES
+            }
+        )
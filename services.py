@@ -1,7 +1,10 @@
 import logging
-from typing import List, Optional
-from repositories import InMemoryChatRepository
-from models import Chat, Message, SearchRequest, SearchResponse
+from typing import AsyncIterator, List, Optional
+from repositories import InMemoryChatRepository, MessageHistory, WriteBufferFullError
+from models import (
+    Chat, Message, SearchRequest, SearchResponse, ForkChatRequest, RegenerateRequest,
+    StatsResponse
+)
 from chatbot import Chatbot
 
 # Get logger for this module
@@ -33,44 +36,120 @@ class ChatService:
         try:
             self.logger.info(f"Processing search for user {request.user_id}, chat {request.chat_id}")
             
-            # Get or create the chat
-            chat = self.chat_repository.get_or_create_chat(
-                request.user_id, 
-                request.chat_id,
-                title=f"Chat {request.chat_id}"
-            )
+            # Create the chat if needed, without materializing an existing one
+            if not self.chat_repository.chat_exists(request.user_id, request.chat_id):
+                self.chat_repository.get_or_create_chat(
+                    request.user_id, 
+                    request.chat_id,
+                    title=f"Chat {request.chat_id}"
+                )
             
-            # Add user message to chat
-            user_message = Message(role="user", content=request.question)
-            chat = self.chat_repository.add_message_to_chat(
-                request.user_id, 
-                request.chat_id, 
-                user_message
-            )
-            
-            # Get previous messages (excluding the current user message for AI context)
-            previous_messages = chat.messages[:-1] if len(chat.messages) > 1 else []
-            
-            # Get AI response using previous messages for context
-            ai_response = await self.chatbot.ainvoke(request.question, previous_messages)
-            
-            # Add AI response to chat
-            ai_message = Message(role="assistant", content=ai_response)
-            final_chat = self.chat_repository.add_message_to_chat(
-                request.user_id, 
-                request.chat_id, 
-                ai_message
-            )
+            messages = await self._answer(request.user_id, request.chat_id, request.question)
+            await self.chat_repository.commit()
             
             self.logger.info(f"Search completed for chat {request.chat_id}")
             
             # Return all messages in the chat
-            return SearchResponse(messages=final_chat.messages)
+            return SearchResponse(messages=messages)
             
         except Exception as e:
             self.logger.error(f"Error processing search request: {e}")
             raise
 
+    async def regenerate(self, user_id: str, chat_id: str, request: RegenerateRequest) -> Optional[SearchResponse]:
+        """
+        Answer a previous user message again, dropping everything after it.
+        
+        Args:
+            user_id: User identifier
+            chat_id: Chat identifier
+            request: Regenerate request with the user message index and an
+                optional chat id to regenerate into a fork
+            
+        Returns:
+            SearchResponse containing all messages in the regenerated chat,
+            or None if the chat doesn't exist
+            
+        Raises:
+            ValueError: If the index doesn't point at a user message or the
+                fork target already exists
+        """
+        try:
+            history = self.chat_repository.get_message_history(user_id, chat_id)
+            if history is None:
+                return None
+            
+            index = request.message_index
+            # Messages before the question, which are kept and sent as context
+            previous_messages = history.to_list(index + 1)
+            if index >= len(previous_messages) or previous_messages[index].role != "user":
+                raise ValueError(f"Message {index} of chat {chat_id} is not a user message")
+            question = previous_messages.pop().content
+            
+            if request.new_chat_id and self.chat_repository.chat_exists(user_id, request.new_chat_id):
+                raise ValueError(f"Chat {request.new_chat_id} already exists for user {user_id}")
+            
+            # Ask again before touching the chat, so a failed LLM call leaves it unchanged
+            ai_response = await self.chatbot.ainvoke(question, previous_messages)
+            
+            # Keep only the messages before the question, then store the new turn
+            if request.new_chat_id:
+                self.chat_repository.fork_chat(user_id, chat_id, request.new_chat_id, message_count=index)
+                target_chat_id = request.new_chat_id
+            else:
+                self.chat_repository.truncate_chat(user_id, chat_id, index)
+                target_chat_id = chat_id
+            
+            user_message = Message(role="user", content=question)
+            ai_message = Message(role="assistant", content=ai_response)
+            self.chat_repository.append_message(user_id, target_chat_id, user_message)
+            self.chat_repository.append_message(user_id, target_chat_id, ai_message)
+            await self.chat_repository.commit()
+            
+            # Nothing ran between the truncation and the appends, so the chat
+            # now holds exactly the kept messages plus the new turn
+            previous_messages.extend((user_message, ai_message))
+            self.logger.info(f"Regenerated message {index} of chat {chat_id} into chat {target_chat_id}")
+            return SearchResponse(messages=previous_messages)
+            
+        except Exception as e:
+            self.logger.error(f"Error regenerating chat: {e}")
+            raise
+
+    async def _answer(self, user_id: str, chat_id: str, question: str) -> List[Message]:
+        """
+        Append a question to an existing chat and store the AI answer.
+        
+        The chat's messages are materialized once, for the AI context, and
+        reused for the result unless the chat was changed during the LLM call.
+        
+        Args:
+            user_id: User identifier
+            chat_id: Chat identifier
+            question: User question
+            
+        Returns:
+            Messages of the chat including the question and the AI answer
+        """
+        # Add user message to chat
+        user_message = Message(role="user", content=question)
+        history = self.chat_repository.append_message(user_id, chat_id, user_message)
+        
+        # Get previous messages (excluding the current user message for AI context)
+        previous_messages = history.to_list(len(history) - 1)
+        
+        # Get AI response using previous messages for context
+        ai_response = await self.chatbot.ainvoke(question, previous_messages)
+        
+        # Add AI response to chat
+        ai_message = Message(role="assistant", content=ai_response)
+        final_history = self.chat_repository.append_message(user_id, chat_id, ai_message)
+        if final_history is not history or len(final_history) != len(previous_messages) + 2:
+            # Other writers changed the chat while the LLM was answering
+            return final_history.to_list()
+        previous_messages.extend((user_message, ai_message))
+        return previous_messages
+
     def get_chat(self, user_id: str, chat_id: str) -> Optional[Chat]:
         """Get a specific chat for a user."""
         try:
@@ -87,18 +166,155 @@ class ChatService:
             self.logger.error(f"Error getting user chats: {e}")
             return []
     
-    def delete_chat(self, user_id: str, chat_id: str) -> bool:
+    async def delete_chat(self, user_id: str, chat_id: str) -> bool:
         """Delete a chat for a user."""
         try:
-            return self.chat_repository.delete_chat(user_id, chat_id)
+            deleted = self.chat_repository.delete_chat(user_id, chat_id)
+        except WriteBufferFullError:
+            raise
         except Exception as e:
             self.logger.error(f"Error deleting chat: {e}")
             return False
+        if deleted:
+            await self.chat_repository.commit()
+        return deleted
     
-    def update_chat_title(self, user_id: str, chat_id: str, title: str) -> Optional[Chat]:
+    async def update_chat_title(self, user_id: str, chat_id: str, title: str) -> Optional[Chat]:
         """Update the title of a chat."""
         try:
-            return self.chat_repository.update_chat_title(user_id, chat_id, title)
+            updated_chat = self.chat_repository.update_chat_title(user_id, chat_id, title)
+        except WriteBufferFullError:
+            raise
         except Exception as e:
             self.logger.error(f"Error updating chat title: {e}")
-            return None
\ No newline at end of file
+            return None
+        if updated_chat is not None:
+            await self.chat_repository.commit()
+        return updated_chat
+    
+    async def fork_chat(self, user_id: str, chat_id: str, request: ForkChatRequest) -> Optional[Chat]:
+        """
+        Fork a chat, sharing its message prefix with the new chat.
+        
+        Returns None if the source chat doesn't exist. Raises ValueError if
+        the target chat already exists or message_count is out of range.
+        """
+        if not self.chat_repository.chat_exists(user_id, chat_id):
+            return None
+        forked_chat = self.chat_repository.fork_chat(
+            user_id,
+            chat_id,
+            request.new_chat_id,
+            message_count=request.message_count,
+            title=request.chat_title
+        )
+        await self.chat_repository.commit()
+        return forked_chat
+    
+    def get_stats(self) -> StatsResponse:
+        """Get usage statistics, including LLM token usage."""
+        stats = self.chat_repository.get_stats()
+        stats.llm_usage = self.chatbot.get_usage()
+        return stats
+    
+    def open_session(self, user_id: str, chat_id: str) -> "ChatSession":
+        """Open a connection-pinned session on a chat. A missing chat is created on the first question."""
+        return ChatSession(self, user_id, chat_id)
+
+
+class ChatSession:
+    """
+    Working state of a single chat pinned to a long-lived connection.
+    
+    The chat is loaded once and its history is kept both as Message objects
+    and as converted LangChain prompt messages. Each turn is still written
+    to the repository; the cached state is only reloaded when the chat was
+    changed outside of this session. A chat that does not exist yet is only
+    created when the first question is asked, so idle connections store
+    nothing.
+    """
+    
+    def __init__(self, chat_service: ChatService, user_id: str, chat_id: str):
+        self.chat_repository = chat_service.chat_repository
+        self.chatbot = chat_service.chatbot
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.logger = logger
+        
+        self.messages: List[Message] = []
+        self.prompt_messages: List = []
+        self._history: Optional[MessageHistory] = None
+        self._history_length = 0
+        self._load()
+        self.logger.info(f"ChatSession opened for user {user_id}, chat {chat_id}")
+    
+    def _load(self) -> None:
+        """Load the chat from the repository (if it exists) and rebuild the cached state."""
+        self._history = self.chat_repository.get_message_history(self.user_id, self.chat_id)
+        self.messages = self._history.to_list() if self._history is not None else []
+        self.prompt_messages = [self.chatbot.convert_message(msg) for msg in self.messages]
+        self._history_length = len(self.messages)
+    
+    def _create(self) -> None:
+        """Create the chat on the first question and load it."""
+        self.chat_repository.get_or_create_chat(
+            self.user_id,
+            self.chat_id,
+            title=f"Chat {self.chat_id}"
+        )
+        self._load()
+    
+    def _refresh(self) -> None:
+        """Reload the cached state if the stored chat changed since the last turn."""
+        history = self.chat_repository.get_message_history(self.user_id, self.chat_id)
+        if history is self._history and (history is None or len(history) == self._history_length):
+            return
+        self.logger.debug(f"Chat {self.chat_id} changed outside the session, reloading")
+        self._load()
+    
+    def _append(self, message: Message) -> None:
+        """Write a message to the repository and to the cached state."""
+        history = self.chat_repository.append_message(self.user_id, self.chat_id, message)
+        expected_length = self._history_length + 1
+        if history is not self._history or len(history) != expected_length:
+            # Other writers touched the chat since the last turn; the stored
+            # history (which includes this message) is the source of truth
+            self.logger.debug(f"Chat {self.chat_id} changed outside the session, reloading")
+            self._load()
+            return
+        
+        self._history_length = expected_length
+        self.messages.append(message)
+        self.prompt_messages.append(self.chatbot.convert_message(message))
+    
+    async def ask(self, question: str) -> AsyncIterator[str]:
+        """
+        Ask a question in the pinned chat, streaming the answer.
+        
+        Args:
+            question: User question
+            
+        Yields:
+            Chunks of the AI response text
+        """
+        try:
+            self._refresh()
+            if self._history is None:
+                self._create()
+            
+            # Prompt history excludes the current question, as in ChatService.search
+            previous_messages = list(self.prompt_messages)
+            self._append(Message(role="user", content=question))
+            
+            chunks = []
+            async for chunk in self.chatbot.astream(question, previous_messages):
+                chunks.append(chunk)
+                yield chunk
+            
+            self._append(Message(role="assistant", content="".join(chunks)))
+            await self.chat_repository.commit()
+            self.logger.info(f"Session turn completed for chat {self.chat_id}")
+            
+        except Exception as e:
+            self.logger.error(f"Error processing session turn: {e}")
+            raise
@@ -0,0 +1,47 @@
+from typing import Any, List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from chatbot import Chatbot
+from httphandlers import init_http_handlers
+from repositories import InMemoryChatRepository
+from scheduler import FairScheduler
+from services import ChatService
+from wshandlers import init_ws_handlers
+
+
+class ScriptedChatModel(GenericFakeChatModel):
+    """
+    Fake chat model whose answer names the question and the history length.
+
+    Questions starting with "fail" raise, to simulate an unavailable LLM.
+    """
+
+    def _generate(self, messages: List[BaseMessage], *args: Any, **kwargs: Any) -> ChatResult:
+        question = messages[-1].content
+        if question.startswith("fail"):
+            raise RuntimeError("LLM unavailable")
+        # The prompt is the system message, the history and the question
+        answer = f"answer to {question} after {len(messages) - 2} messages"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+
+@pytest.fixture
+def chat_service():
+    chatbot = Chatbot(llm=ScriptedChatModel(messages=iter([])), prompt_caching=False)
+    return ChatService(InMemoryChatRepository(), chatbot)
+
+
+@pytest.fixture
+def client(chat_service):
+    app = FastAPI()
+    scheduler = FairScheduler()
+    init_http_handlers(app, chat_service, scheduler)
+    init_ws_handlers(app, chat_service, scheduler)
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,51 @@
+import pytest
+
+from models import Message
+
+
+async def ask(session, question):
+    return "".join([chunk async for chunk in session.ask(question)])
+
+
+@pytest.mark.asyncio
+async def test_opening_a_session_does_not_create_the_chat(chat_service):
+    session = chat_service.open_session("u", "c")
+
+    assert session.messages == []
+    assert chat_service.get_chat("u", "c") is None
+    assert chat_service.get_stats().chat_count == 0
+
+
+@pytest.mark.asyncio
+async def test_first_question_creates_the_chat(chat_service):
+    session = chat_service.open_session("u", "c")
+
+    assert await ask(session, "q1") == "answer to q1 after 0 messages"
+
+    chat = chat_service.get_chat("u", "c")
+    assert [message.content for message in chat.messages] == ["q1", "answer to q1 after 0 messages"]
+    assert chat.title == "Chat c"
+    assert session.messages == chat.messages
+
+
+@pytest.mark.asyncio
+async def test_session_reloads_after_outside_writes(chat_service):
+    session = chat_service.open_session("u", "c")
+    await ask(session, "q1")
+
+    chat_service.chat_repository.append_message("u", "c", Message(role="user", content="outside"))
+    assert await ask(session, "q2") == "answer to q2 after 3 messages"
+
+    chat_service.chat_repository.truncate_chat("u", "c", 0)
+    assert await ask(session, "q3") == "answer to q3 after 0 messages"
+    assert [message.content for message in session.messages] == ["q3", "answer to q3 after 0 messages"]
+
+
+@pytest.mark.asyncio
+async def test_session_recreates_a_deleted_chat(chat_service):
+    session = chat_service.open_session("u", "c")
+    await ask(session, "q1")
+
+    await chat_service.delete_chat("u", "c")
+    assert await ask(session, "q2") == "answer to q2 after 0 messages"
+    assert len(chat_service.get_chat("u", "c").messages) == 2
@@ -0,0 +1,120 @@
+from typing import Any, List
+
+import pytest
+from pydantic import Field
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+
+from chatbot import Chatbot, CACHE_CONTROL
+from models import Message
+
+
+class RecordingChatModel(GenericFakeChatModel):
+    """Fake chat model that keeps the messages of every call."""
+
+    calls: List[List[BaseMessage]] = Field(default_factory=list)
+
+    def _generate(self, messages: List[BaseMessage], *args: Any, **kwargs: Any):
+        self.calls.append(messages)
+        return super()._generate(messages, *args, **kwargs)
+
+
+def make_chatbot(responses: List[Any], prompt_caching: bool):
+    llm = RecordingChatModel(messages=iter(responses))
+    return Chatbot(llm=llm, prompt_caching=prompt_caching), llm
+
+
+def previous_messages(count: int) -> List[Message]:
+    roles = ("user", "assistant")
+    return [Message(role=roles[i % 2], content=f"message {i}") for i in range(count)]
+
+
+def is_marked(message: BaseMessage) -> bool:
+    """Whether any content block of the message carries a cache marker."""
+    if isinstance(message.content, str):
+        return False
+    return any(
+        isinstance(block, dict) and block.get("cache_control") == CACHE_CONTROL
+        for block in message.content
+    )
+
+
+def test_prompt_caching_marks_system_message_and_history_breakpoints():
+    chatbot, llm = make_chatbot(["answer"], prompt_caching=True)
+
+    assert chatbot.invoke("question", previous_messages(4)) == "answer"
+
+    sent = llm.calls[0]
+    system, history, question = sent[0], sent[1:-1], sent[-1]
+    assert system.type == "system"
+    assert is_marked(system)
+    assert len(history) == 4
+    # Breakpoints on the last history message and on the previous turn's last message
+    assert is_marked(history[-1])
+    assert is_marked(history[-3])
+    assert not is_marked(history[-2])
+    assert not is_marked(history[-4])
+    assert not is_marked(question)
+    assert [block["text"] for block in history[-1].content] == ["message 3"]
+
+
+def test_prompt_caching_with_short_history():
+    chatbot, llm = make_chatbot(["answer"], prompt_caching=True)
+
+    chatbot.invoke("question", previous_messages(1))
+
+    history = llm.calls[0][1:-1]
+    assert len(history) == 1
+    assert is_marked(history[0])
+
+
+def test_no_cache_markers_when_caching_disabled():
+    chatbot, llm = make_chatbot(["answer"], prompt_caching=False)
+
+    chatbot.invoke("question", previous_messages(4))
+
+    sent = llm.calls[0]
+    assert len(sent) == 6
+    assert not any(is_marked(message) for message in sent)
+    assert all(isinstance(message.content, str) for message in sent)
+
+
+@pytest.mark.asyncio
+async def test_usage_accumulates_cache_tokens():
+    responses = [
+        AIMessage(content="first", usage_metadata={
+            "input_tokens": 100,
+            "output_tokens": 10,
+            "total_tokens": 110,
+            "input_token_details": {"cache_creation": 80},
+        }),
+        AIMessage(content="second", usage_metadata={
+            "input_tokens": 120,
+            "output_tokens": 12,
+            "total_tokens": 132,
+            "input_token_details": {"cache_read": 80, "cache_creation": 30},
+        }),
+    ]
+    chatbot, _ = make_chatbot(responses, prompt_caching=True)
+
+    assert await chatbot.ainvoke("question 1", []) == "first"
+    assert await chatbot.ainvoke("question 2", previous_messages(2)) == "second"
+
+    usage = chatbot.get_usage()
+    assert usage.calls == 2
+    assert usage.input_tokens == 220
+    assert usage.output_tokens == 22
+    assert usage.cache_read_tokens == 80
+    assert usage.cache_creation_tokens == 110
+
+
+def test_get_usage_returns_a_copy():
+    chatbot, _ = make_chatbot([AIMessage(content="answer", usage_metadata={
+        "input_tokens": 5, "output_tokens": 1, "total_tokens": 6
+    })], prompt_caching=False)
+
+    usage = chatbot.get_usage()
+    chatbot.invoke("question", [])
+
+    assert usage.calls == 0
+    assert chatbot.get_usage().input_tokens == 5
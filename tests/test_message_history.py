@@ -0,0 +1,128 @@
+import pytest
+
+from models import Message
+from repositories import InMemoryChatRepository, MessageHistory
+
+
+def make_messages(*contents):
+    roles = ("user", "assistant")
+    return [Message(role=roles[i % 2], content=content) for i, content in enumerate(contents)]
+
+
+def contents(messages):
+    return [message.content for message in messages]
+
+
+@pytest.fixture
+def repository():
+    repository = InMemoryChatRepository()
+    repository.get_or_create_chat("u", "parent")
+    for message in make_messages("q1", "a1", "q2", "a2"):
+        repository.append_message("u", "parent", message)
+    return repository
+
+
+def test_fork_shares_prefix():
+    history = MessageHistory(tail=make_messages("q1", "a1", "q2", "a2"))
+    fork = history.fork(2)
+
+    assert len(fork) == 2
+    assert fork.parent is history
+    assert fork.tail == []
+    assert contents(fork.to_list()) == ["q1", "a1"]
+
+
+def test_fork_is_unaffected_by_parent_appends():
+    history = MessageHistory(tail=make_messages("q1", "a1"))
+    fork = history.fork(2)
+
+    history.append(Message(role="user", content="parent only"))
+    fork.append(Message(role="user", content="fork only"))
+
+    assert contents(history.to_list()) == ["q1", "a1", "parent only"]
+    assert contents(fork.to_list()) == ["q1", "a1", "fork only"]
+
+
+def test_fork_of_fork_references_closest_ancestor_holding_prefix():
+    history = MessageHistory(tail=make_messages("q1", "a1", "q2", "a2"))
+    fork = history.fork(3)
+    fork.append(Message(role="assistant", content="a2 fork"))
+
+    assert fork.fork(2).parent is history
+    grandchild = fork.fork(4)
+    assert grandchild.parent is fork
+    assert contents(grandchild.to_list()) == ["q1", "a1", "q2", "a2 fork"]
+
+
+def test_fork_rejects_out_of_range_length():
+    history = MessageHistory(tail=make_messages("q1", "a1"))
+
+    with pytest.raises(ValueError):
+        history.fork(3)
+    with pytest.raises(ValueError):
+        history.fork(-1)
+    assert len(history.fork(0)) == 0
+
+
+def test_to_list_with_length():
+    history = MessageHistory(tail=make_messages("q1", "a1")).fork(2)
+    history.append(Message(role="user", content="q2"))
+
+    assert contents(history.to_list(1)) == ["q1"]
+    assert contents(history.to_list(3)) == ["q1", "a1", "q2"]
+    assert contents(history.to_list(10)) == ["q1", "a1", "q2"]
+
+
+def test_byte_size_at_across_ancestors():
+    # "é" is 2 bytes and "€" is 3 bytes in UTF-8
+    history = MessageHistory(tail=make_messages("ab", "é", "€"))
+    fork = history.fork(2)
+    fork.append(Message(role="assistant", content="xyz"))
+    grandchild = fork.fork(3)
+    grandchild.append(Message(role="user", content="€€"))
+
+    assert [grandchild.byte_size_at(length) for length in range(5)] == [0, 2, 4, 7, 13]
+    assert grandchild.byte_size == 13
+    assert fork.byte_size == 7
+    assert history.byte_size == 7
+
+
+def test_forked_chat_survives_parent_append_truncate_and_delete(repository):
+    repository.fork_chat("u", "parent", "fork", message_count=3)
+
+    repository.append_message("u", "parent", Message(role="user", content="q3"))
+    assert contents(repository.get_chat("u", "fork").messages) == ["q1", "a1", "q2"]
+
+    repository.truncate_chat("u", "parent", 1)
+    assert contents(repository.get_chat("u", "parent").messages) == ["q1"]
+    assert contents(repository.get_chat("u", "fork").messages) == ["q1", "a1", "q2"]
+
+    assert repository.delete_chat("u", "parent")
+    fork = repository.get_chat("u", "fork")
+    assert contents(fork.messages) == ["q1", "a1", "q2"]
+    assert fork.parent_chat_id == "parent"
+
+
+def test_fork_of_forked_chat(repository):
+    repository.fork_chat("u", "parent", "fork", message_count=2)
+    repository.append_message("u", "fork", Message(role="user", content="q2 fork"))
+    repository.fork_chat("u", "fork", "fork2", title="Second fork")
+    repository.append_message("u", "fork2", Message(role="assistant", content="a2 fork2"))
+
+    fork2 = repository.get_chat("u", "fork2")
+    assert contents(fork2.messages) == ["q1", "a1", "q2 fork", "a2 fork2"]
+    assert fork2.title == "Second fork"
+    assert fork2.parent_chat_id == "fork"
+    assert contents(repository.get_chat("u", "fork").messages) == ["q1", "a1", "q2 fork"]
+    assert contents(repository.get_chat("u", "parent").messages) == ["q1", "a1", "q2", "a2"]
+
+
+def test_fork_chat_rejects_existing_target_and_bad_count(repository):
+    repository.get_or_create_chat("u", "other")
+
+    with pytest.raises(ValueError):
+        repository.fork_chat("u", "parent", "other")
+    with pytest.raises(ValueError):
+        repository.fork_chat("u", "parent", "fork", message_count=5)
+    with pytest.raises(ValueError):
+        repository.fork_chat("u", "missing", "fork")
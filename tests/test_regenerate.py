@@ -0,0 +1,69 @@
+import pytest
+
+
+@pytest.fixture
+def chat(client):
+    for question in ("q1", "q2"):
+        response = client.post("/search", json={"user_id": "u", "chat_id": "c", "question": question})
+        assert response.status_code == 200
+    return client.get("/searches/u/chats/c").json()
+
+
+def contents(messages):
+    return [message["content"] for message in messages]
+
+
+def test_regenerate_in_place(client, chat):
+    response = client.post("/searches/u/chats/c/regenerate", json={"message_index": 0})
+
+    assert response.status_code == 200
+    assert contents(response.json()["messages"]) == ["q1", "answer to q1 after 0 messages"]
+    assert contents(client.get("/searches/u/chats/c").json()["messages"]) == contents(response.json()["messages"])
+
+
+def test_regenerate_keeps_messages_before_the_question(client, chat):
+    response = client.post("/searches/u/chats/c/regenerate", json={"message_index": 2})
+
+    assert response.status_code == 200
+    assert contents(response.json()["messages"]) == [
+        "q1", "answer to q1 after 0 messages", "q2", "answer to q2 after 2 messages"
+    ]
+
+
+def test_regenerate_into_new_chat(client, chat):
+    response = client.post("/searches/u/chats/c/regenerate", json={"message_index": 0, "new_chat_id": "b"})
+
+    assert response.status_code == 200
+    assert contents(response.json()["messages"]) == ["q1", "answer to q1 after 0 messages"]
+    forked = client.get("/searches/u/chats/b").json()
+    assert forked["parent_chat_id"] == "c"
+    assert contents(forked["messages"]) == ["q1", "answer to q1 after 0 messages"]
+    # The source chat is unchanged
+    assert contents(client.get("/searches/u/chats/c").json()["messages"]) == contents(chat["messages"])
+
+
+@pytest.mark.parametrize("body", [
+    {"message_index": 1},
+    {"message_index": 4},
+    {"message_index": 0, "new_chat_id": "c"},
+])
+def test_regenerate_rejects_invalid_requests(client, chat, body):
+    response = client.post("/searches/u/chats/c/regenerate", json=body)
+
+    assert response.status_code == 400
+    assert contents(client.get("/searches/u/chats/c").json()["messages"]) == contents(chat["messages"])
+
+
+def test_regenerate_missing_chat(client):
+    response = client.post("/searches/u/chats/missing/regenerate", json={"message_index": 0})
+
+    assert response.status_code == 404
+
+
+def test_fork_endpoint(client, chat):
+    response = client.post("/searches/u/chats/c/fork", json={"new_chat_id": "f", "message_count": 2})
+
+    assert response.status_code == 200
+    assert contents(response.json()["messages"]) == ["q1", "answer to q1 after 0 messages"]
+    assert client.post("/searches/u/chats/missing/fork", json={"new_chat_id": "g"}).status_code == 404
+    assert client.post("/searches/u/chats/c/fork", json={"new_chat_id": "f"}).status_code == 400
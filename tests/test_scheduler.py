@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from scheduler import FairScheduler
+
+
+@pytest.mark.parametrize("weight", [0, -1.0, float("nan"), float("inf")])
+def test_rejects_invalid_user_weights(weight):
+    with pytest.raises(ValueError):
+        FairScheduler(user_weights={"user": weight})
+
+
+@pytest.mark.asyncio
+async def test_weighted_user_gets_larger_share():
+    scheduler = FairScheduler(max_concurrency=1, user_weights={"heavy": 2.0})
+    order = []
+
+    # Hold the only slot so every request below is queued before dispatch
+    blocker = await scheduler.acquire("blocker")
+
+    async def run(user_id):
+        async with scheduler.slot(user_id):
+            order.append(user_id)
+
+    tasks = [asyncio.create_task(run(user_id)) for user_id in ["light"] * 3 + ["heavy"] * 6]
+    await asyncio.sleep(0)
+    scheduler.release(blocker)
+    await asyncio.gather(*tasks)
+
+    assert order[:6].count("heavy") == 4
@@ -0,0 +1,146 @@
+import random
+
+import pytest
+
+from models import Message
+from repositories import InMemoryChatRepository
+from utils import Histogram
+
+
+def make_message(role, content):
+    return Message(role=role, content=content)
+
+
+def assert_totals_match_chats(repository):
+    """Compare the incrementally maintained stats with a full recount."""
+    chats = repository.get_all_chats()
+    stats = repository.get_stats()
+    histogram = Histogram()
+    for chat in chats:
+        histogram.add(len(chat.messages))
+    lengths = sorted((len(chat.messages) for chat in chats if chat.messages), reverse=True)
+
+    assert stats.chat_count == len(chats)
+    assert stats.message_count == sum(len(chat.messages) for chat in chats)
+    assert stats.message_bytes == sum(
+        len(message.content.encode("utf-8")) for chat in chats for message in chat.messages
+    )
+    assert stats.chat_length_histogram == histogram.to_dict()
+    assert [entry.count for entry in stats.longest_chats] == lengths[:10]
+    for entry in stats.longest_chats:
+        user_id, chat_id = entry.key.split("/", 1)
+        assert len(repository.get_chat(user_id, chat_id).messages) == entry.count
+
+
+@pytest.fixture
+def repository():
+    repository = InMemoryChatRepository()
+    repository.get_or_create_chat("u", "c")
+    for role, content in [("user", "q1"), ("assistant", "a1 é"), ("user", "q2"), ("assistant", "a2 €")]:
+        repository.append_message("u", "c", make_message(role, content))
+    return repository
+
+
+def test_stats_after_appends(repository):
+    stats = repository.get_stats()
+
+    assert stats.chat_count == 1
+    assert stats.message_count == 4
+    assert stats.message_bytes == 2 + 5 + 2 + 6
+    assert stats.chat_length_histogram == {"4-7": 1}
+    assert [(entry.key, entry.count) for entry in stats.longest_chats] == [("u/c", 4)]
+    assert_totals_match_chats(repository)
+
+
+def test_stats_after_fork(repository):
+    repository.fork_chat("u", "c", "f", message_count=2)
+    stats = repository.get_stats()
+
+    # Forked messages count once per chat, although they are shared
+    assert stats.chat_count == 2
+    assert stats.message_count == 6
+    assert stats.message_bytes == 15 + 7
+    assert stats.chat_length_histogram == {"2-3": 1, "4-7": 1}
+    assert [(entry.key, entry.count) for entry in stats.longest_chats] == [("u/c", 4), ("u/f", 2)]
+    assert_totals_match_chats(repository)
+
+
+def test_stats_after_truncate(repository):
+    repository.fork_chat("u", "c", "f")
+    repository.truncate_chat("u", "c", 1)
+    stats = repository.get_stats()
+
+    assert stats.message_count == 5
+    assert stats.message_bytes == 15 + 2
+    assert stats.chat_length_histogram == {"1": 1, "4-7": 1}
+    assert [(entry.key, entry.count) for entry in stats.longest_chats] == [("u/f", 4), ("u/c", 1)]
+
+    repository.truncate_chat("u", "c", 0)
+    assert repository.get_stats().chat_length_histogram == {"0": 1, "4-7": 1}
+    assert [entry.key for entry in repository.get_stats().longest_chats] == ["u/f"]
+    assert_totals_match_chats(repository)
+
+
+def test_stats_after_delete(repository):
+    repository.fork_chat("u", "c", "f", message_count=3)
+    assert repository.delete_chat("u", "c")
+    stats = repository.get_stats()
+
+    assert stats.chat_count == 1
+    assert stats.message_count == 3
+    assert stats.message_bytes == 2 + 5 + 2
+    assert stats.chat_length_histogram == {"2-3": 1}
+    assert [(entry.key, entry.count) for entry in stats.longest_chats] == [("u/f", 3)]
+    assert_totals_match_chats(repository)
+
+
+def test_stats_after_delete_user_chats(repository):
+    repository.get_or_create_chat("v", "c")
+    repository.append_message("v", "c", make_message("user", "hello"))
+    repository.delete_user_chats("u")
+    stats = repository.get_stats()
+
+    assert stats.user_count == 1
+    assert [(entry.key, entry.count) for entry in stats.longest_chats] == [("v/c", 1)]
+    assert_totals_match_chats(repository)
+
+
+def test_stats_after_clear_all_chats(repository):
+    repository.fork_chat("u", "c", "f")
+    repository.clear_all_chats()
+    stats = repository.get_stats()
+
+    assert stats.chat_count == 0
+    assert stats.message_count == 0
+    assert stats.message_bytes == 0
+    assert stats.chat_length_histogram == {}
+    assert stats.longest_chats == []
+    # Activity is history, so it survives deletions
+    assert [(entry.key, entry.count) for entry in stats.top_users] == [("u", 4)]
+    assert sum(stats.daily_active_users.values()) == 1
+
+    repository.get_or_create_chat("u", "c")
+    repository.append_message("u", "c", make_message("user", "q1"))
+    assert_totals_match_chats(repository)
+
+
+def test_stats_follow_random_mutations():
+    rng = random.Random(0)
+    repository = InMemoryChatRepository()
+    for _ in range(2000):
+        user_id, chat_id = f"u{rng.randrange(3)}", f"c{rng.randrange(12)}"
+        operation = rng.random()
+        if operation < 0.8:
+            repository.get_or_create_chat(user_id, chat_id)
+            repository.append_message(user_id, chat_id, make_message("user", "x" * rng.randrange(5)))
+        elif operation < 0.9 and repository.chat_exists(user_id, chat_id):
+            length = len(repository.get_message_history(user_id, chat_id))
+            repository.truncate_chat(user_id, chat_id, rng.randrange(length + 1))
+        elif operation < 0.95 and repository.chat_exists(user_id, chat_id):
+            new_chat_id = f"{chat_id}-{rng.randrange(1000)}"
+            if not repository.chat_exists(user_id, new_chat_id):
+                repository.fork_chat(user_id, chat_id, new_chat_id)
+        else:
+            repository.delete_chat(user_id, chat_id)
+
+    assert_totals_match_chats(repository)
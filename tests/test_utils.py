@@ -0,0 +1,87 @@
+import random
+from collections import Counter
+
+import pytest
+
+from utils import CountMinSketch, Histogram, HyperLogLog, TopK
+
+
+@pytest.mark.parametrize("cardinality", [100, 10000, 100000])
+def test_hyperloglog_estimate_within_error(cardinality):
+    sketch = HyperLogLog()
+    for i in range(cardinality):
+        sketch.add(f"user-{i}")
+        # Repeated values do not change the estimate
+        sketch.add(f"user-{i}")
+
+    # Four standard errors (1.6% each at the default precision)
+    assert abs(sketch.count() - cardinality) <= 0.065 * cardinality
+
+
+def test_hyperloglog_empty():
+    assert HyperLogLog().count() == 0
+
+
+def test_count_min_sketch_never_undercounts():
+    rng = random.Random(0)
+    # A narrow sketch, so many keys collide
+    sketch = CountMinSketch(width=64, depth=3)
+    counts = Counter()
+    for _ in range(5000):
+        key = f"key-{int(rng.paretovariate(1.2))}"
+        amount = rng.randint(1, 3)
+        counts[key] += amount
+        assert sketch.add(key, amount) >= counts[key]
+
+    for key, count in counts.items():
+        assert sketch.estimate(key) >= count
+
+
+def test_count_min_sketch_is_exact_without_collisions():
+    sketch = CountMinSketch()
+    sketch.add("a", 5)
+    sketch.add("b")
+
+    assert sketch.estimate("a") == 5
+    assert sketch.estimate("b") == 1
+    assert sketch.estimate("missing") == 0
+
+
+def test_top_k_keeps_heavy_hitters():
+    top = TopK(k=3)
+    for key, count in [("a", 50), ("b", 30), ("c", 20)] + [(f"light-{i}", 1) for i in range(200)]:
+        for _ in range(count):
+            top.add(key)
+
+    assert top.top() == [("a", 50), ("b", 30), ("c", 20)]
+
+
+def test_histogram_add_and_remove():
+    histogram = Histogram()
+    for value in (0, 1, 2, 3, 4, 7, 8):
+        histogram.add(value)
+
+    assert histogram.to_dict() == {"0": 1, "1": 1, "2-3": 2, "4-7": 2, "8-15": 1}
+
+    histogram.add(3, -1)
+    histogram.add(8, -1)
+    assert histogram.to_dict() == {"0": 1, "1": 1, "2-3": 1, "4-7": 2}
+
+
+def test_histogram_move():
+    histogram = Histogram()
+    histogram.add(2)
+    histogram.add(5)
+
+    # Within a bucket nothing changes
+    histogram.move(2, 3)
+    assert histogram.to_dict() == {"2-3": 1, "4-7": 1}
+
+    histogram.move(3, 4)
+    assert histogram.to_dict() == {"4-7": 2}
+
+    histogram.move(4, 0)
+    assert histogram.to_dict() == {"0": 1, "4-7": 1}
+
+    histogram.clear()
+    assert histogram.to_dict() == {}
@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from scheduler import FairScheduler
+from wshandlers import init_ws_handlers
+
+
+def receive_turn(websocket):
+    """Receive frames until the end of a turn; returns (tokens, last frame)."""
+    tokens = []
+    while True:
+        frame = websocket.receive_json()
+        if frame["type"] == "token":
+            tokens.append(frame["content"])
+        else:
+            return tokens, frame
+
+
+def test_streams_tokens_then_done(client):
+    with client.websocket_connect("/ws/u/chats/c") as websocket:
+        websocket.send_json({"question": "q1"})
+        tokens, frame = receive_turn(websocket)
+
+    assert len(tokens) > 1
+    assert "".join(tokens) == "answer to q1 after 0 messages"
+    assert frame["type"] == "done"
+    assert frame["message"]["role"] == "assistant"
+    assert frame["message"]["content"] == "answer to q1 after 0 messages"
+    assert frame["queue_wait_ms"] >= 0
+    messages = client.get("/searches/u/chats/c").json()["messages"]
+    assert [message["content"] for message in messages] == ["q1", "answer to q1 after 0 messages"]
+
+
+@pytest.mark.parametrize("raw_frame, detail", [
+    ("not json", "Frame must be a JSON object"),
+    ('["q1"]', "Frame must be a JSON object"),
+    ('{"question": ""}', "Frame must contain a question"),
+    ('{"question": "q1", "priority": "urgent"}', "Unknown priority: urgent"),
+])
+def test_invalid_frames_get_error_frames(client, raw_frame, detail):
+    with client.websocket_connect("/ws/u/chats/c") as websocket:
+        websocket.send_text(raw_frame)
+        assert websocket.receive_json() == {"type": "error", "detail": detail}
+
+        # The connection stays usable
+        websocket.send_json({"question": "q1"})
+        _, frame = receive_turn(websocket)
+        assert frame["type"] == "done"
+
+
+def test_llm_error_ends_only_the_turn(client):
+    with client.websocket_connect("/ws/u/chats/c") as websocket:
+        websocket.send_json({"question": "fail please"})
+        tokens, frame = receive_turn(websocket)
+        assert tokens == []
+        assert frame["type"] == "error"
+        assert "LLM unavailable" in frame["detail"]
+
+        websocket.send_json({"question": "q2"})
+        tokens, frame = receive_turn(websocket)
+        assert frame["type"] == "done"
+        # The failed question is kept in the chat, as with /search
+        assert "".join(tokens) == "answer to q2 after 1 messages"
+
+
+def test_ping_pong_frames_are_ignored(client):
+    with client.websocket_connect("/ws/u/chats/c") as websocket:
+        websocket.send_json({"type": "pong"})
+        websocket.send_json({"question": "q1"})
+        _, frame = receive_turn(websocket)
+        assert frame["type"] == "done"
+
+
+def test_session_reloads_after_http_search(client):
+    with client.websocket_connect("/ws/u/chats/c") as websocket:
+        websocket.send_json({"question": "q1"})
+        receive_turn(websocket)
+
+        response = client.post("/search", json={"user_id": "u", "chat_id": "c", "question": "q2"})
+        assert response.status_code == 200
+
+        websocket.send_json({"question": "q3"})
+        tokens, frame = receive_turn(websocket)
+
+    assert "".join(tokens) == "answer to q3 after 4 messages"
+    messages = client.get("/searches/u/chats/c").json()["messages"]
+    assert [message["content"] for message in messages][::2] == ["q1", "q2", "q3"]
+
+
+def test_connecting_does_not_create_the_chat(client):
+    with client.websocket_connect("/ws/u/chats/c"):
+        pass
+
+    assert client.get("/searches/u/chats/c").status_code == 404
+
+
+def make_app(chat_service, monkeypatch, max_connections):
+    monkeypatch.setenv("WS_MAX_CONNECTIONS", str(max_connections))
+    app = FastAPI()
+    init_ws_handlers(app, chat_service, FairScheduler())
+    return app
+
+
+def test_connection_limit(chat_service, monkeypatch):
+    client = TestClient(make_app(chat_service, monkeypatch, max_connections=1))
+
+    with client.websocket_connect("/ws/u/chats/c"):
+        with pytest.raises(WebSocketDisconnect) as rejected:
+            with client.websocket_connect("/ws/u/chats/d"):
+                pass
+        assert rejected.value.code == 1013
+
+    # The slot is released when the connection ends
+    with client.websocket_connect("/ws/u/chats/d") as websocket:
+        websocket.send_json({"question": "q1"})
+        _, frame = receive_turn(websocket)
+        assert frame["type"] == "done"
+
+
+class HandshakeWebSocket:
+    """WebSocket stub whose handshake completes only when released."""
+
+    def __init__(self, accepted: asyncio.Event, fail_accept: bool = False):
+        self.accepted = accepted
+        self.fail_accept = fail_accept
+        self.close_codes = []
+
+    async def accept(self):
+        await self.accepted.wait()
+        if self.fail_accept:
+            raise RuntimeError("handshake failed")
+
+    async def close(self, code):
+        self.close_codes.append(code)
+
+    async def receive_text(self):
+        raise WebSocketDisconnect()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_handshakes_respect_connection_limit(chat_service, monkeypatch):
+    app = make_app(chat_service, monkeypatch, max_connections=1)
+    endpoint = next(route.endpoint for route in app.routes if route.path == "/ws/{user_id}/chats/{chat_id}")
+    accepted = asyncio.Event()
+    first, second = HandshakeWebSocket(accepted), HandshakeWebSocket(accepted)
+
+    handshakes = [asyncio.create_task(endpoint(websocket, "u", "c")) for websocket in (first, second)]
+    await asyncio.sleep(0)
+    accepted.set()
+    await asyncio.gather(*handshakes)
+
+    assert first.close_codes == []
+    assert second.close_codes == [1013]
+
+
+@pytest.mark.asyncio
+async def test_failed_handshake_releases_its_connection(chat_service, monkeypatch):
+    app = make_app(chat_service, monkeypatch, max_connections=1)
+    endpoint = next(route.endpoint for route in app.routes if route.path == "/ws/{user_id}/chats/{chat_id}")
+    accepted = asyncio.Event()
+    accepted.set()
+
+    with pytest.raises(RuntimeError):
+        await endpoint(HandshakeWebSocket(accepted, fail_accept=True), "u", "c")
+
+    websocket = HandshakeWebSocket(accepted)
+    await endpoint(websocket, "u", "c")
+    assert websocket.close_codes == []
@@ -0,0 +1,361 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from models import ForkChatRequest, Message
+from repositories import JsonlChatStore, WriteBehindChatRepository, WriteBufferFullError
+
+
+def contents(chat):
+    return [message.content for message in chat.messages]
+
+
+def journal_lines(path):
+    with open(path, "rb") as f:
+        return f.read().splitlines()
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "chats.jsonl")
+
+
+@pytest.fixture
+def fail_fsync_once(monkeypatch):
+    """Make the next os.fsync fail, after the data was written."""
+    real_fsync = os.fsync
+    calls = []
+
+    def fsync(fd):
+        calls.append(fd)
+        if len(calls) == 1:
+            raise OSError("fsync failed")
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", fsync)
+    return calls
+
+
+class PartialWriteStore(JsonlChatStore):
+    """Store whose next commit writes half of its data and then fails."""
+
+    fail_next = False
+
+    def commit(self, mutations):
+        if not self.fail_next:
+            return super().commit(mutations)
+        self.fail_next = False
+        with open(self.path, "ab") as f:
+            f.write(b'{"op": "create_chat", "ch')
+        raise OSError("disk full")
+
+
+@pytest.mark.asyncio
+async def test_failed_fsync_does_not_duplicate_records(journal_path, fail_fsync_once):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    repository.get_or_create_chat("u", "a")
+    repository.append_message("u", "a", Message(role="user", content="q1"))
+
+    await repository.close()
+    assert len(fail_fsync_once) == 1
+    # The failed batch is still buffered and the journal was rolled back
+    assert len(repository._buffer) == 2
+    assert journal_lines(journal_path) == []
+
+    await repository.close()
+    assert repository._buffer == []
+    assert len(journal_lines(journal_path)) == 2
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert contents(restarted.get_chat("u", "a")) == ["q1"]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_partial_write_leaves_valid_journal(journal_path):
+    store = PartialWriteStore(journal_path)
+    repository = WriteBehindChatRepository(store)
+    repository.get_or_create_chat("u", "a")
+    await repository.close()
+
+    store.fail_next = True
+    repository.append_message("u", "a", Message(role="user", content="q1"))
+    await repository.close()
+    assert len(repository._buffer) == 1
+
+    await repository.close()
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert contents(restarted.get_chat("u", "a")) == ["q1"]
+    assert len(journal_lines(journal_path)) == 2
+
+
+@pytest.mark.asyncio
+async def test_failing_store_backs_off_and_bounds_the_buffer(journal_path, monkeypatch):
+    store = JsonlChatStore(journal_path)
+    attempts = []
+
+    def failing_commit(mutations):
+        attempts.append(len(mutations))
+        raise OSError("store down")
+
+    monkeypatch.setattr(store, "commit", failing_commit)
+    repository = WriteBehindChatRepository(store, flush_interval=0.001, max_buffer_size=3, max_retry_interval=0.05)
+    repository.get_or_create_chat("u", "a")
+    repository.append_message("u", "a", Message(role="user", content="q1"))
+    repository.append_message("u", "a", Message(role="user", content="q2"))
+
+    with pytest.raises(WriteBufferFullError):
+        repository.append_message("u", "a", Message(role="user", content="q3"))
+    # Rejected mutations are not applied
+    assert contents(repository.get_chat("u", "a")) == ["q1", "q2"]
+
+    for _ in range(6):
+        await repository._flush()
+    assert repository._retry_delay() == 0.05
+    assert len(attempts) == 6
+    assert len(repository._buffer) == 3
+
+    monkeypatch.undo()
+    await repository.close()
+    assert repository._failures == 0
+    repository.append_message("u", "a", Message(role="user", content="q3"))
+    await repository.close()
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert contents(restarted.get_chat("u", "a")) == ["q1", "q2", "q3"]
+
+
+@pytest.mark.asyncio
+async def test_commit_after_failed_flush_raises_with_durability_after(journal_path, fail_fsync_once):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), durability="after")
+    repository.start()
+    repository.get_or_create_chat("u", "a")
+
+    with pytest.raises(OSError):
+        await repository.commit()
+
+    repository.append_message("u", "a", Message(role="user", content="q1"))
+    await repository.commit()
+    await repository.close()
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert contents(restarted.get_chat("u", "a")) == ["q1"]
+
+
+def build_chats(repository):
+    """Chats with a fork, a truncation and a deleted parent."""
+    repository.get_or_create_chat("u", "a", title="First")
+    for i in range(6):
+        repository.append_message("u", "a", Message(role="user" if i % 2 == 0 else "assistant", content=f"m{i}"))
+    repository.fork_chat("u", "a", "b", message_count=4, title="Fork")
+    repository.append_message("u", "b", Message(role="assistant", content="b4"))
+    repository.fork_chat("u", "b", "c")
+    repository.truncate_chat("u", "a", 2)
+    repository.delete_chat("u", "b")
+    repository.get_or_create_chat("v", "d")
+    repository.append_message("v", "d", Message(role="user", content="é"))
+    repository.update_chat_title("v", "d", "Renamed")
+
+
+def chat_state(repository):
+    return {
+        (chat.user_id, chat.chat_id): chat.model_dump()
+        for chat in repository.get_all_chats()
+    }
+
+
+@pytest.mark.asyncio
+async def test_compaction_replaces_journal_with_snapshot(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), compact_threshold=10)
+    build_chats(repository)
+    await repository.close()
+
+    lines = journal_lines(journal_path)
+    assert all(b'"op": "snapshot_' in line for line in lines)
+    # Histories of a, c (sharing a's old node) and d, two chats and the activity sketches
+    assert len(lines) < 15
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert chat_state(restarted) == chat_state(repository)
+    assert restarted.get_stats() == repository.get_stats()
+    assert [message.content for message in restarted.get_chat("u", "c").messages] == ["m0", "m1", "m2", "m3", "b4"]
+    assert restarted.get_chat("u", "a").messages[-1].content == "m1"
+
+
+@pytest.mark.asyncio
+async def test_compacted_forks_keep_sharing_history(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), compact_threshold=1)
+    repository.get_or_create_chat("u", "a")
+    repository.append_message("u", "a", Message(role="user", content="q1"))
+    repository.fork_chat("u", "a", "b")
+    repository.fork_chat("u", "a", "c")
+    await repository.close()
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    b = restarted.get_message_history("u", "b")
+    c = restarted.get_message_history("u", "c")
+    assert b.parent is c.parent is restarted.get_message_history("u", "a")
+
+
+@pytest.mark.asyncio
+async def test_mutations_after_compaction_are_replayed(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), compact_threshold=10)
+    build_chats(repository)
+    await repository.close()
+
+    repository.append_message("u", "c", Message(role="user", content="after"))
+    repository.delete_chat("v", "d")
+    await repository.close()
+    assert len([line for line in journal_lines(journal_path) if b"snapshot_" not in line]) == 2
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert chat_state(restarted) == chat_state(repository)
+    assert restarted.get_stats() == repository.get_stats()
+
+
+@pytest.mark.asyncio
+async def test_failed_compaction_keeps_journal(journal_path, monkeypatch):
+    store = JsonlChatStore(journal_path)
+    repository = WriteBehindChatRepository(store, compact_threshold=10)
+
+    def failing_rewrite(records):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "rewrite", failing_rewrite)
+    build_chats(repository)
+    await repository.close()
+    assert repository._buffer == []
+    assert not any(b"snapshot_" in line for line in journal_lines(journal_path))
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert chat_state(restarted) == chat_state(repository)
+
+
+@pytest.mark.asyncio
+async def test_compaction_disabled(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), compact_threshold=0)
+    build_chats(repository)
+    await repository.close()
+
+    assert not any(b"snapshot_" in line for line in journal_lines(journal_path))
+
+
+@pytest.mark.asyncio
+async def test_replay_round_trip_keeps_messages_titles_and_timestamps(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), compact_threshold=0)
+    build_chats(repository)
+    await repository.close()
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert chat_state(restarted) == chat_state(repository)
+    assert restarted.get_stats() == repository.get_stats()
+    assert restarted.get_chat("v", "d").title == "Renamed"
+    assert restarted.get_chat("u", "c").parent_chat_id == "b"
+    assert [message.content for message in restarted.get_chat("u", "a").messages] == ["m0", "m1"]
+    original = repository.get_chat("u", "a")
+    replayed = restarted.get_chat("u", "a")
+    assert (replayed.created_at, replayed.updated_at) == (original.created_at, original.updated_at)
+    assert replayed.messages[0].timestamp == original.messages[0].timestamp
+
+
+class GatedStore(JsonlChatStore):
+    """Store whose commits wait until released."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.release = None
+
+    def commit(self, mutations):
+        self.release.wait()
+        super().commit(mutations)
+
+
+@pytest.mark.asyncio
+async def test_durability_after_waits_for_flush(journal_path):
+    store = GatedStore(journal_path)
+    store.release = threading.Event()
+    repository = WriteBehindChatRepository(store, durability="after")
+    repository.start()
+    repository.get_or_create_chat("u", "a")
+
+    commit = asyncio.create_task(repository.commit())
+    try:
+        await asyncio.sleep(0.05)
+        assert not commit.done()
+        assert not os.path.exists(journal_path) or journal_lines(journal_path) == []
+    finally:
+        store.release.set()
+    await asyncio.wait_for(commit, timeout=1)
+    assert len(journal_lines(journal_path)) == 1
+    await repository.close()
+
+
+@pytest.mark.asyncio
+async def test_durability_before_returns_immediately(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), flush_interval=60)
+    repository.start()
+    repository.get_or_create_chat("u", "a")
+
+    await repository.commit()
+    assert not os.path.exists(journal_path)
+    await repository.close()
+    assert len(journal_lines(journal_path)) == 1
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_buffered_mutations(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), flush_interval=60, batch_size=1000)
+    repository.start()
+    repository.get_or_create_chat("u", "a")
+    repository.append_message("u", "a", Message(role="user", content="q1"))
+
+    await repository.close()
+    assert repository._flusher is None
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert [message.content for message in restarted.get_chat("u", "a").messages] == ["q1"]
+
+
+@pytest.mark.asyncio
+async def test_replay_truncates_incomplete_last_record(journal_path):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    repository.get_or_create_chat("u", "a")
+    await repository.close()
+    with open(journal_path, "ab") as f:
+        f.write(b'{"op": "append_message", "user_id": "u"')
+
+    restarted = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert restarted.get_chat("u", "a").messages == []
+    assert len(journal_lines(journal_path)) == 1
+
+    # New records are appended after the last complete one
+    restarted.append_message("u", "a", Message(role="user", content="q1"))
+    await restarted.close()
+    again = WriteBehindChatRepository(JsonlChatStore(journal_path))
+    assert [message.content for message in again.get_chat("u", "a").messages] == ["q1"]
+
+
+def test_replay_rejects_corrupt_record_before_the_end(journal_path):
+    with open(journal_path, "wb") as f:
+        f.write(b'{"op": "create_chat", "ch\n{"op": "clear_all_chats"}\n')
+
+    with pytest.raises(ValueError):
+        WriteBehindChatRepository(JsonlChatStore(journal_path))
+
+
+@pytest.mark.asyncio
+async def test_service_writes_are_durable_when_they_return(journal_path, chat_service):
+    repository = WriteBehindChatRepository(JsonlChatStore(journal_path), durability="after")
+    repository.start()
+    chat_service.chat_repository = repository
+    repository.get_or_create_chat("u", "a")
+    repository.append_message("u", "a", Message(role="user", content="q1"))
+
+    await chat_service.fork_chat("u", "a", ForkChatRequest(new_chat_id="b"))
+    assert len(journal_lines(journal_path)) == 3
+    await chat_service.update_chat_title("u", "b", "Renamed")
+    assert len(journal_lines(journal_path)) == 4
+    await chat_service.delete_chat("u", "a")
+    assert len(journal_lines(journal_path)) == 5
+    await repository.close()
@@ -0,0 +1,174 @@
+import math
+import hashlib
+from typing import Dict, List, Tuple
+
+
+def _hash64(value: str, salt: bytes = b"") -> int:
+    """Stable 64-bit hash of a string."""
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8, salt=salt).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality estimator.
+
+    Uses 2^precision one-byte registers; the standard error is about
+    1.04 / sqrt(2^precision) (1.6% with the default precision of 12).
+    """
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.register_count = 1 << precision
+        self.registers = bytearray(self.register_count)
+        self.alpha = 0.7213 / (1 + 1.079 / self.register_count)
+
+    def add(self, value: str) -> None:
+        """Add a value to the set."""
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        """
+        Estimate the number of distinct values added.
+
+        Returns:
+            Estimated cardinality
+        """
+        total = sum(2.0 ** -register for register in self.registers)
+        estimate = self.alpha * self.register_count ** 2 / total
+
+        # Small range correction (linear counting)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.register_count and zeros:
+            estimate = self.register_count * math.log(self.register_count / zeros)
+
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    """
+    Count-min sketch for approximate frequency counts.
+
+    Estimates never undercount; they overcount by at most
+    e / width * total with probability 1 - exp(-depth).
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key: str) -> List[int]:
+        # Double hashing: h1 + i * h2 gives depth independent-enough indexes
+        h1 = _hash64(key, salt=b"cms1")
+        h2 = _hash64(key, salt=b"cms2") | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """
+        Add to a key's count.
+
+        Args:
+            key: Key to count
+            count: Amount to add
+
+        Returns:
+            Estimated count of the key after the update
+        """
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += count
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """Estimated count of a key."""
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class TopK:
+    """
+    Heavy hitters tracked with a count-min sketch.
+
+    Keeps the k keys with the highest estimated counts seen so far.
+    """
+
+    def __init__(self, k: int = 10, width: int = 2048, depth: int = 4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates: Dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1) -> None:
+        """Add to a key's count and update the heavy hitters."""
+        estimate = self.sketch.add(key, count)
+        if key in self.candidates or len(self.candidates) < self.k:
+            self.candidates[key] = estimate
+            return
+
+        smallest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[smallest]:
+            del self.candidates[smallest]
+            self.candidates[key] = estimate
+
+    def top(self) -> List[Tuple[str, int]]:
+        """
+        Get the heavy hitters.
+
+        Returns:
+            List of (key, estimated count), highest first
+        """
+        return sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)
+
+
+class Histogram:
+    """
+    Histogram with power-of-two buckets: 0, 1, 2-3, 4-7, 8-15, ...
+
+    Values can be moved between buckets, so it can track a changing
+    quantity such as the length of each chat.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+
+    @staticmethod
+    def _bucket(value: int) -> int:
+        return value.bit_length()
+
+    def add(self, value: int, count: int = 1) -> None:
+        """Add (or with a negative count, remove) a value."""
+        bucket = self._bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        if self.buckets[bucket] <= 0:
+            del self.buckets[bucket]
+
+    def move(self, old_value: int, new_value: int) -> None:
+        """Replace one occurrence of old_value with new_value."""
+        if self._bucket(old_value) != self._bucket(new_value):
+            self.add(old_value, -1)
+            self.add(new_value)
+
+    def clear(self) -> None:
+        """Remove all values."""
+        self.buckets.clear()
+
+    def to_dict(self) -> Dict[str, int]:
+        """
+        Get bucket counts keyed by their value range.
+
+        Returns:
+            Dictionary such as {"0": 3, "1": 5, "2-3": 1}, in bucket order
+        """
+        result = {}
+        for bucket in sorted(self.buckets):
+            low = 0 if bucket == 0 else 1 << (bucket - 1)
+            high = 0 if bucket == 0 else (1 << bucket) - 1
+            label = str(low) if low == high else f"{low}-{high}"
+            result[label] = self.buckets[bucket]
+        return result
@@ -0,0 +1,165 @@
+import os
+import json
+import asyncio
+import logging
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, status
+
+from services import ChatService, ChatSession
+from scheduler import FairScheduler, QueueFullError, Ticket
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+def init_ws_handlers(app: FastAPI, chat_service: ChatService, scheduler: FairScheduler):
+    """
+    Initialize the WebSocket handlers.
+
+    Protocol (JSON frames):
+    - client -> server: {"question": "...", "priority": "interactive"} or {"type": "pong"}
+    - server -> client: {"type": "token", "content": "..."} per answer chunk,
+      {"type": "done", "message": {...}, "queue_wait_ms": ...} at the end of a turn,
+      {"type": "ping"} while idle, {"type": "error", "detail": "..."}
+    """
+    # Idle connections get an application-level ping every interval and are
+    # closed after the idle timeout without any client frame
+    heartbeat_interval = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+    idle_timeout = float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+    # A client that does not drain a frame within this time is disconnected
+    send_timeout = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+    max_connections = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+    # Answer chunks buffered per connection between the LLM and the client
+    stream_buffer_size = int(os.getenv("WS_STREAM_BUFFER_SIZE", "1024"))
+
+    connections = {"active": 0}
+
+    async def send_frame(websocket: WebSocket, frame: dict):
+        """Send a frame, failing if the client does not drain it in time."""
+        await asyncio.wait_for(websocket.send_json(frame), timeout=send_timeout)
+
+    async def generate_answer(session: ChatSession, question: str, user_id: str, priority: str,
+                              chunks: asyncio.Queue) -> Ticket:
+        """
+        Stream an answer into the queue while holding a scheduler slot.
+
+        The slot is released as soon as the LLM finishes, not when the client
+        has read the answer, so slow clients do not hold up other requests
+        while the buffer has room.
+        """
+        answer = session.ask(question)
+        try:
+            async with scheduler.slot(user_id, priority) as ticket:
+                async for chunk in answer:
+                    await chunks.put(chunk)
+            return ticket
+        finally:
+            await answer.aclose()
+
+    async def next_chunk(chunks: asyncio.Queue, producer: asyncio.Task):
+        """Get the next buffered chunk, or None once the producer has finished and the buffer is empty."""
+        while chunks.empty():
+            if producer.done():
+                return None
+            getter = asyncio.ensure_future(chunks.get())
+            await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                return getter.result()
+            getter.cancel()
+        return chunks.get_nowait()
+
+    @app.websocket("/ws/{user_id}/chats/{chat_id}")
+    async def websocket_chat(websocket: WebSocket, user_id: str, chat_id: str):
+        """
+        Conversation endpoint keeping the chat's working state for the life of the connection.
+        """
+        if connections["active"] >= max_connections:
+            logger.warning(f"Rejecting WebSocket for user {user_id}, chat {chat_id}: connection limit reached")
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+
+        # Reserve the connection before the first await, so concurrent
+        # handshakes cannot all pass the limit check
+        connections["active"] += 1
+        try:
+            await websocket.accept()
+        except Exception:
+            connections["active"] -= 1
+            raise
+        logger.info(f"WebSocket connected - User: {user_id}, Chat: {chat_id}, Active: {connections['active']}")
+
+        try:
+            session = chat_service.open_session(user_id, chat_id)
+            chunks = asyncio.Queue(maxsize=stream_buffer_size)
+            loop = asyncio.get_running_loop()
+            last_seen = loop.time()
+
+            while True:
+                try:
+                    raw_frame = await asyncio.wait_for(websocket.receive_text(), timeout=heartbeat_interval)
+                except asyncio.TimeoutError:
+                    if loop.time() - last_seen >= idle_timeout:
+                        logger.info(f"Closing idle WebSocket - User: {user_id}, Chat: {chat_id}")
+                        await websocket.close(code=status.WS_1001_GOING_AWAY)
+                        return
+                    await send_frame(websocket, {"type": "ping"})
+                    continue
+
+                last_seen = loop.time()
+                try:
+                    frame = json.loads(raw_frame)
+                except ValueError:
+                    frame = None
+                if not isinstance(frame, dict):
+                    await send_frame(websocket, {"type": "error", "detail": "Frame must be a JSON object"})
+                    continue
+                if frame.get("type") == "pong":
+                    continue
+
+                question = frame.get("question")
+                if not question or not isinstance(question, str):
+                    await send_frame(websocket, {"type": "error", "detail": "Frame must contain a question"})
+                    continue
+
+                priority = frame.get("priority", "interactive")
+                if priority not in scheduler.PRIORITIES:
+                    await send_frame(websocket, {"type": "error", "detail": f"Unknown priority: {priority}"})
+                    continue
+
+                # Turns are processed one at a time; the next question is not
+                # read until the current answer has been sent
+                logger.info(f"WebSocket question - User: {user_id}, Chat: {chat_id}, Question: {question[:50]}...")
+                producer = asyncio.create_task(generate_answer(session, question, user_id, priority, chunks))
+                try:
+                    while (chunk := await next_chunk(chunks, producer)) is not None:
+                        await send_frame(websocket, {"type": "token", "content": chunk})
+                finally:
+                    # A failed send ends the connection; stop generating for it
+                    if not producer.done():
+                        producer.cancel()
+                        await asyncio.gather(producer, return_exceptions=True)
+
+                # LLM errors end the turn; send errors end the connection
+                try:
+                    ticket = producer.result()
+                except QueueFullError as e:
+                    await send_frame(websocket, {"type": "error", "detail": str(e)})
+                    continue
+                except Exception as e:
+                    logger.error(f"WebSocket turn failed - User: {user_id}, Chat: {chat_id}: {e}")
+                    await send_frame(websocket, {"type": "error", "detail": f"Failed to answer: {e}"})
+                    continue
+                await send_frame(websocket, {
+                    "type": "done",
+                    "message": session.messages[-1].model_dump(mode="json"),
+                    "queue_wait_ms": round(ticket.queue_wait * 1000, 1)
+                })
+
+        except WebSocketDisconnect:
+            logger.info(f"WebSocket disconnected - User: {user_id}, Chat: {chat_id}")
+        except asyncio.TimeoutError:
+            logger.warning(f"WebSocket client too slow, closing - User: {user_id}, Chat: {chat_id}")
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        except Exception as e:
+            logger.error(f"WebSocket error - User: {user_id}, Chat: {chat_id}: {e}", exc_info=True)
+            await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        finally:
+            connections["active"] -= 1